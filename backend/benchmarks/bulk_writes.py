@@ -0,0 +1,106 @@
+'''
+Check and time GameService.bulk_update_games against Postgres, for batches
+with and without per-item versions. Postgres types a VALUES column from
+its cells, so a batch where every item leaves a field out is the case
+SQLite can't catch.
+
+Run from backend/ against a disposable Postgres migrated to head:
+    python -m benchmarks.bulk_writes --rows 500 --repeat 20
+Exits non-zero when a bulk update fails or skips games it should update.
+'''
+import sys
+import json
+import time
+import asyncio
+import argparse
+import statistics
+from datetime import datetime, timedelta
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlmodel import text, create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from src.config import Config
+from src.games import service
+from src.games.service import GameService
+from src.games.schemas import GameBulkUpdateItem
+
+SCHEMA = "bench_bulk_writes"
+
+async def seed(conn, rows: int) -> list:
+    '''Create a games clone in a throwaway schema and return the uids and versions it was filled with'''
+    await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+    await conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+    await conn.execute(text(f"CREATE TABLE {SCHEMA}.games (LIKE public.games INCLUDING DEFAULTS INCLUDING INDEXES)"))
+    result = await conn.execute(text(f"""
+        INSERT INTO {SCHEMA}.games (uid, title, game_time, location, buy_in, host, created_at, updated_at, version)
+        SELECT gen_random_uuid(), 'Game ' || i, now() + interval '1 day', 'Freret Street', 10, 'host', now(), now(), 1
+        FROM generate_series(1, :rows) AS i
+        RETURNING uid
+    """), {"rows": rows})
+    return [uid for (uid,) in result.all()]
+
+def scenarios(uids: list) -> dict[str, list[GameBulkUpdateItem]]:
+    game_time = (datetime.now() + timedelta(days=2)).strftime("%Y-%m-%d %H:%M")
+    item = {"title": "Edited", "game_time": game_time, "location": "Audubon Park", "buy_in": 20}
+    return {
+        "no_versions": [GameBulkUpdateItem(uid=uid, **item) for uid in uids],
+        "mixed_versions": [GameBulkUpdateItem(uid=uid, version=None if i % 2 else 1, **item) for i, uid in enumerate(uids)],
+    }
+
+async def main(rows: int, repeat: int) -> list[str]:
+    engine = AsyncEngine(create_engine(url=Config.DATABASE_URL))
+    game_service = GameService()
+    report, failures = {"rows": rows, "repeat": repeat}, []
+
+    # Nobody is listening, don't bump the real listing version on every run
+    async def skip_publish(event_type, games):
+        pass
+    service.publish_game_events = skip_publish
+
+    try:
+        async with engine.begin() as conn:
+            uids = await seed(conn, rows)
+
+        async with engine.connect() as conn:
+            # Unqualified "games" in the service's SQL now resolves to the scratch copy
+            await conn.execute(text(f"SET search_path TO {SCHEMA}, public"))
+            # SET outlives the transaction, committing it leaves the session its own transactions
+            await conn.commit()
+            session = AsyncSession(bind=conn)
+            for name, items in scenarios(uids).items():
+                samples = []
+                for _ in range(repeat):
+                    # Every run starts from version 1, so versioned items match
+                    await session.execute(text("UPDATE games SET version = 1"))
+                    start = time.perf_counter()
+                    try:
+                        result = await game_service.bulk_update_games(items, session)
+                    except Exception as e:
+                        failures.append(f"{name}: {e}")
+                        await session.rollback()
+                        break
+                    samples.append((time.perf_counter() - start) * 1000)
+                    if result.errors:
+                        failures.append(f"{name}: {len(result.errors)} items skipped, e.g. {result.errors[0].detail}")
+                        break
+
+                if samples:
+                    report[name] = {"p50_ms": round(statistics.median(samples), 3), "max_ms": round(max(samples), 3)}
+    finally:
+        async with engine.begin() as conn:
+            await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        await engine.dispose()
+
+    print(json.dumps(report, indent=2))
+    return failures
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    failures = asyncio.run(main(args.rows, args.repeat))
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,60 @@
+'''
+Compare bytes on the wire and encode time of a game listing in every
+format the API can negotiate: JSON or MessagePack, each uncompressed,
+gzip'd and brotli'd at the levels CompressionMiddleware is configured with.
+
+Runs in-process, no database needed:
+    python -m benchmarks.encodings --sizes 20 100 1000 --repeat 50
+'''
+import gzip
+import json
+import time
+import argparse
+import statistics
+import brotli
+
+from src.config import Config
+from src.responses import ModelJSON
+from src.games.schemas import GamePageModel
+
+from .serialization import make_games
+
+def time_encoder(encode, repeat: int) -> tuple[bytes, float]:
+    '''Median wall time of one encode, in ms, plus its output'''
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        payload = encode()
+        samples.append((time.perf_counter() - start) * 1000)
+
+    return payload, statistics.median(samples)
+
+def main(sizes: list[int], repeat: int) -> None:
+    page_json = ModelJSON(GamePageModel)
+    compressors = {
+        "identity": lambda body: body,
+        "gzip": lambda body: gzip.compress(body, compresslevel=Config.COMPRESSION_GZIP_LEVEL),
+        "br": lambda body: brotli.compress(body, quality=Config.COMPRESSION_BROTLI_QUALITY),
+    }
+
+    report = {}
+    for size in sizes:
+        page = GamePageModel(games=make_games(size), next_cursor=None)
+        report[size] = {}
+        for media, serialize in (("json", page_json.dumps), ("msgpack", page_json.packb)):
+            body, serialize_ms = time_encoder(lambda: serialize(page), repeat)
+            for encoding, compress in compressors.items():
+                wire, compress_ms = time_encoder(lambda: compress(body), repeat)
+                report[size][f"{media}+{encoding}"] = {
+                    "bytes": len(wire),
+                    "encode_ms": round(serialize_ms + compress_ms, 3),
+                }
+
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[20, 100, 1_000])
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+    main(args.sizes, args.repeat)
@@ -0,0 +1,104 @@
+'''
+Seed a scratch copy of the games table and time GameService.search_games
+for typical queries ("holdem near me tonight under $20"), against the
+indexes from migration d41b7e8c2f05.
+
+Run from backend/ against a disposable Postgres with the contrib extensions:
+    python -m benchmarks.game_search --rows 1000000 --searches 200
+'''
+import json
+import time
+import random
+import asyncio
+import argparse
+import statistics
+from datetime import datetime, timedelta
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlmodel import text, create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from src.config import Config
+from src.games.service import GameService
+from src.games.schemas import GameSearchModel
+
+SCHEMA = "bench_game_search"
+# Around Tulane's uptown campus
+CENTER = (29.9407, -90.1203)
+
+async def seed(conn, rows: int) -> None:
+    '''Create a games clone (with the migrated indexes) in a throwaway schema and fill it server-side'''
+    await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+    await conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+    await conn.execute(text(f"CREATE TABLE {SCHEMA}.games (LIKE public.games INCLUDING DEFAULTS INCLUDING INDEXES)"))
+    await conn.execute(text(f"""
+        INSERT INTO {SCHEMA}.games (uid, title, game_time, location, buy_in, host, latitude, longitude, created_at, updated_at, version)
+        SELECT
+            gen_random_uuid(),
+            (ARRAY['Friday', 'Late night', 'Weekend', 'Casual', 'High stakes'])[1 + i % 5] || ' ' ||
+            (ARRAY['holdem', 'omaha', 'stud', 'tournament', 'cash game'])[1 + (i / 5) % 5] || ' ' || i,
+            now() + (random() * interval '60 days'),
+            (ARRAY['Lavin-Bernick Center', 'Howard-Tilton Library', 'Freret Street', 'Magazine Street', 'Audubon Park'])[1 + i % 5],
+            (random() * 100)::int,
+            'host' || (i % 1000),
+            CASE WHEN i % 10 = 0 THEN NULL ELSE :lat + (random() - 0.5) * 0.4 END,
+            CASE WHEN i % 10 = 0 THEN NULL ELSE :lng + (random() - 0.5) * 0.4 END,
+            now(), now(), 1
+        FROM generate_series(1, :rows) AS i
+    """), {"rows": rows, "lat": CENTER[0], "lng": CENTER[1]})
+    await conn.execute(text(f"ANALYZE {SCHEMA}.games"))
+
+def scenarios() -> dict[str, GameSearchModel]:
+    now = datetime.now()
+    near = {"lat": CENTER[0] + random.uniform(-0.05, 0.05), "lng": CENTER[1] + random.uniform(-0.05, 0.05)}
+    return {
+        "text": GameSearchModel(q=random.choice(["holdem", "omaha tournament", "late night cash"])),
+        "near_next_48h_under_20": GameSearchModel(
+            **near, radius_km=2, game_time_from=now, game_time_to=now + timedelta(hours=48), buy_in_max=20
+        ),
+        "text_near": GameSearchModel(q="holdem", **near, radius_km=2, game_time_from=now),
+    }
+
+async def time_searches(session: AsyncSession, name: str, searches: int) -> dict:
+    '''Run one search per sample and summarize the latencies in ms'''
+    game_service = GameService()
+    samples = []
+    for _ in range(searches):
+        search = scenarios()[name]
+        start = time.perf_counter()
+        await game_service.search_games(search, session)
+        samples.append((time.perf_counter() - start) * 1000)
+
+    samples.sort()
+    return {
+        "p50_ms": round(statistics.median(samples), 3),
+        "p95_ms": round(samples[int(len(samples) * 0.95) - 1], 3),
+        "max_ms": round(samples[-1], 3),
+    }
+
+async def main(rows: int, searches: int) -> None:
+    engine = AsyncEngine(create_engine(url=Config.DATABASE_URL))
+    report = {"rows": rows, "searches": searches}
+
+    try:
+        async with engine.begin() as conn:
+            await seed(conn, rows)
+
+        async with engine.connect() as conn:
+            # Unqualified "games" in the service's SQL now resolves to the scratch copy
+            await conn.execute(text(f"SET search_path TO {SCHEMA}, public"))
+            session = AsyncSession(bind=conn)
+            for name in scenarios():
+                report[name] = await time_searches(session, name, searches)
+    finally:
+        async with engine.begin() as conn:
+            await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        await engine.dispose()
+
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--searches", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main(args.rows, args.searches))
@@ -0,0 +1,239 @@
+'''
+Boot the API in-process against local stand-ins, seed users and games, and
+drive a mix of logged-in sessions at a fixed concurrency. Prints throughput
+and p50/p95/p99 latency per route as JSON, to diff across commits.
+
+Each virtual user logs in, makes --ops-per-session weighted requests
+(GET /games, GET /games/{uid}, PATCH /games/{uid}) and logs out, repeatedly.
+
+Defaults need nothing running: aiosqlite and fakeredis (with lupa, for the
+rate limit script) stand in for Postgres and Redis:
+    python -m benchmarks.loadtest --duration 30 --concurrency 20 --output before.json
+Against a throwaway Postgres and a local Redis instead:
+    python -m benchmarks.loadtest --database-url postgresql+asyncpg://... --redis localhost:6379
+'''
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import tempfile
+import argparse
+import subprocess
+from collections import defaultdict
+
+# Settings are read when src is imported, so src is only imported after configure()
+SETTINGS_DEFAULTS = {
+    "DOMAIN": "localhost:8000",
+    "VERSION": "v1",
+    "JWT_SECRET": "loadtest-secret-loadtest-secret-loadtest",
+    "JWT_ALGORITHM": "HS256",
+    "ACCESS_TOKEN_EXPIRY": "3600",
+    "REFRESH_TOKEN_EXPIRY": "2",
+    "JTI_EXPIRY": "3600",
+    "RESEND_API_KEY": "re_loadtest",
+}
+PASSWORD = "loadtest"
+WEIGHTS = {"list": 50, "get": 35, "patch": 15}
+
+def configure(args: argparse.Namespace) -> None:
+    '''Point the app at the stand-ins before anything reads Config'''
+    for name, value in SETTINGS_DEFAULTS.items():
+        os.environ.setdefault(name, value)
+
+    os.environ["DATABASE_URL"] = args.database_url
+    # Every virtual user logs in over and over from the same client address
+    os.environ["RATE_LIMIT_LOGIN"] = "1000000/1"
+    # Seeded users are verified, but never hand mail to a real provider
+    os.environ["MAIL_PROVIDER"] = "file"
+    os.environ["MAIL_FILE_PATH"] = os.path.join(tempfile.gettempdir(), "loadtest-outbox.jsonl")
+
+    if args.redis == "fake":
+        import fakeredis
+        import redis.asyncio
+
+        server = fakeredis.FakeServer()
+
+        class FakeRedis(fakeredis.FakeAsyncRedis):
+            def __init__(self, *a, host=None, port=None, **kwargs):
+                super().__init__(server=server, **kwargs)
+
+        redis.asyncio.Redis = FakeRedis
+    else:
+        host, _, port = args.redis.partition(":")
+        os.environ["REDIS_HOST"] = host
+        os.environ["REDIS_PORT"] = port or "6379"
+
+    os.environ.setdefault("REDIS_HOST", "localhost")
+    os.environ.setdefault("REDIS_PORT", "6379")
+
+async def seed(users: int, games: int) -> tuple[list[str], list[str]]:
+    '''Create tables and insert verified users and upcoming games directly'''
+    from datetime import datetime, timedelta
+    from sqlalchemy import insert
+    from sqlmodel.ext.asyncio.session import AsyncSession
+
+    from src.db.main import init_db, async_engine
+    from src.auth.models import User
+    from src.auth.utils import generate_hashed_pwd
+    from src.games.models import Game
+
+    await init_db()
+    # One bcrypt hash shared by every user, seeding shouldn't take minutes
+    hashed_password = generate_hashed_pwd(PASSWORD)
+    usernames = [f"lt{i}" for i in range(users)]
+    now = datetime.now()
+
+    async with AsyncSession(async_engine) as session:
+        await session.exec(insert(User), params=[
+            {
+                "username": username,
+                "email": f"{username}@tulane.edu",
+                "hashed_password": hashed_password,
+                "college": "Tulane University",
+                "is_verified": True,
+            }
+            for username in usernames
+        ])
+        result = await session.exec(insert(Game).returning(Game.uid), params=[
+            {
+                "title": f"Load test game {i}",
+                "game_time": now + timedelta(hours=i % (24 * 30)),
+                "location": random.choice(["Lavin-Bernick Center", "Freret Street", "Audubon Park"]),
+                "buy_in": random.randint(0, 100),
+                "host": random.choice(usernames),
+            }
+            for i in range(games)
+        ])
+        game_uids = [str(uid) for uid in result.scalars().all()]
+        await session.commit()
+
+    return usernames, game_uids
+
+class Recorder:
+    '''Latency samples and failures per route label'''
+    def __init__(self) -> None:
+        self.samples: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+
+    async def request(self, client, label: str, method: str, url: str, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except Exception:
+            self.errors[label] += 1
+            return None
+        finally:
+            self.samples[label].append((time.perf_counter() - start) * 1000)
+
+        if response.status_code >= 400:
+            self.errors[label] += 1
+        return response
+
+def percentile(samples: list[float], p: float) -> float:
+    '''Nearest-rank percentile of sorted samples'''
+    return samples[max(0, min(len(samples) - 1, round(p / 100 * len(samples)) - 1))]
+
+async def virtual_user(client, recorder: Recorder, username: str, game_uids: list[str], ops: int, deadline: float) -> None:
+    prefix = f"/api/{os.environ['VERSION']}"
+    actions, weights = zip(*WEIGHTS.items())
+
+    while time.monotonic() < deadline:
+        response = await recorder.request(
+            client, "POST /auth/login", "POST", f"{prefix}/auth/login",
+            json={"username": username, "password": PASSWORD}
+        )
+        if response is None or response.status_code != 200:
+            continue
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        for action in random.choices(actions, weights, k=ops):
+            game_uid = random.choice(game_uids)
+            if action == "list":
+                await recorder.request(client, "GET /games", "GET", f"{prefix}/games/", headers=headers)
+            elif action == "get":
+                await recorder.request(client, "GET /games/{uid}", "GET", f"{prefix}/games/{game_uid}", headers=headers)
+            else:
+                await recorder.request(
+                    client, "PATCH /games/{uid}", "PATCH", f"{prefix}/games/{game_uid}", headers=headers,
+                    json={"title": f"Edited {random.randint(0, 9999)}", "game_time": "2030-01-01 20:00", "location": "Freret Street", "buy_in": 20}
+                )
+
+        await recorder.request(client, "GET /auth/logout", "GET", f"{prefix}/auth/logout", headers=headers)
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def main(args: argparse.Namespace) -> dict:
+    import httpx
+    from src import app
+    from src.db.main import async_engine
+
+    usernames, game_uids = await seed(args.users, args.games)
+    recorder = Recorder()
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://loadtest", timeout=60) as client:
+        start = time.monotonic()
+        deadline = start + args.duration
+        await asyncio.gather(*[
+            virtual_user(client, recorder, usernames[i % len(usernames)], game_uids, args.ops_per_session, deadline)
+            for i in range(args.concurrency)
+        ])
+        elapsed = time.monotonic() - start
+
+    await async_engine.dispose()
+
+    routes = {}
+    for label, samples in sorted(recorder.samples.items()):
+        samples.sort()
+        routes[label] = {
+            "requests": len(samples),
+            "errors": recorder.errors[label],
+            "throughput_rps": round(len(samples) / elapsed, 1),
+            "p50_ms": round(percentile(samples, 50), 3),
+            "p95_ms": round(percentile(samples, 95), 3),
+            "p99_ms": round(percentile(samples, 99), 3),
+        }
+
+    total = sum(route["requests"] for route in routes.values())
+    return {
+        "commit": git_commit(),
+        "database": args.database_url.split("://")[0],
+        "redis": args.redis,
+        "concurrency": args.concurrency,
+        "duration_s": round(elapsed, 2),
+        "users": args.users,
+        "games": args.games,
+        "requests": total,
+        "throughput_rps": round(total / elapsed, 1),
+        "routes": routes,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=f"sqlite+aiosqlite:///{os.path.join(tempfile.mkdtemp(), 'loadtest.sqlite')}")
+    parser.add_argument("--redis", default="fake", help='"fake" for fakeredis, or host[:port]')
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--games", type=int, default=1_000)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--ops-per-session", type=int, default=20)
+    parser.add_argument("--output", help="Also write the report to this file")
+    args = parser.parse_args()
+
+    configure(args)
+    report = asyncio.run(main(args))
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+    # Don't wait on background pub/sub tasks against the stand-ins
+    sys.stdout.flush()
+    os._exit(0)
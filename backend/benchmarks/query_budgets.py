@@ -0,0 +1,87 @@
+'''
+Drive the auth routes with declared QueryBudgets in-process and fail if any
+runs more SQL statements than its budget, to catch redundant queries and
+N+1s before they ship. Runs with ENVIRONMENT=test, so QueryBudgetMiddleware
+raises on an over-budget request and repeated statement shapes are flagged.
+
+Like the load test, it needs nothing running by default:
+    python -m benchmarks.query_budgets
+Exits non-zero when a budget is exceeded.
+'''
+import os
+import sys
+import asyncio
+import tempfile
+import argparse
+
+from .loadtest import configure, seed, PASSWORD
+
+async def main() -> list[str]:
+    import httpx
+    from src import app
+    from src.db.main import async_engine
+    from src.db.query_budget import count_queries, QueryBudgetExceeded
+
+    usernames, _ = await seed(users=1, games=1)
+    prefix = f"/api/{os.environ['VERSION']}/auth"
+    failures = []
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://budgets") as client:
+        async def check(label: str, budget: int, expected_status: int, method: str, url: str, **kwargs) -> None:
+            try:
+                with count_queries(budget) as queries:
+                    response = await client.request(method, url, **kwargs)
+            except QueryBudgetExceeded as e:
+                failures.append(str(e))
+                return
+
+            print(f"{label}: {response.status_code}, {queries.count}/{budget} statements")
+            if response.status_code != expected_status:
+                failures.append(f"{label} answered {response.status_code}: {response.text}")
+
+        # Email and username are checked in one query, then the user is inserted
+        await check("signup", 2, 201, "POST", f"{prefix}/signup", json={
+            "username": "budget", "email": "budget@tulane.edu", "password": PASSWORD, "confirm_password": PASSWORD
+        })
+        await check("signup, username taken", 1, 403, "POST", f"{prefix}/signup", json={
+            "username": usernames[0], "email": "other@tulane.edu", "password": PASSWORD, "confirm_password": PASSWORD
+        })
+
+        response = await client.post(f"{prefix}/login", json={"username": usernames[0], "password": PASSWORD})
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        # The user lookup on an identity cache miss, then a single UPDATE ... RETURNING
+        await check("edit-profile", 2, 200, "PATCH", f"{prefix}/edit-profile", headers=headers, json={"username": "renamed"})
+        # The rename invalidated the cached user, so it is loaded once more
+        await check("me", 1, 200, "GET", f"{prefix}/me", headers=headers)
+
+        # The checker itself must fail a request that goes over
+        try:
+            with count_queries(0):
+                await client.post(f"{prefix}/signup", json={
+                    "username": "over", "email": "over@tulane.edu", "password": PASSWORD, "confirm_password": PASSWORD
+                })
+            failures.append("count_queries(0) let a signup through")
+        except QueryBudgetExceeded:
+            pass
+
+    await async_engine.dispose()
+    return failures
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=f"sqlite+aiosqlite:///{os.path.join(tempfile.mkdtemp(), 'budgets.sqlite')}")
+    parser.add_argument("--redis", default="fake", help='"fake" for fakeredis, or host[:port]')
+    args = parser.parse_args()
+
+    os.environ["ENVIRONMENT"] = "test"
+    configure(args)
+    failures = asyncio.run(main())
+
+    for failure in failures:
+        print(failure, file=sys.stderr)
+
+    # Don't wait on background pub/sub tasks against the stand-ins
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os._exit(1 if failures else 0)
@@ -0,0 +1,84 @@
+'''
+Time the game list response path in each JSON_RESPONSE_MODE: "standard"
+(response_model validation plus the stdlib encoder), "pydantic" and "orjson"
+(pre-encoded bytes through src.responses.ModelJSON).
+
+Runs in-process against a throwaway app, no database needed:
+    python -m benchmarks.serialization --sizes 100 1000 10000 --repeat 20
+'''
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import statistics
+from typing import List
+from datetime import datetime, timedelta
+import httpx
+from fastapi import FastAPI
+
+from src.config import Config
+from src.responses import ModelJSON, orjson
+from src.games.models import Game
+
+MODES = ["standard", "pydantic"] + (["orjson"] if orjson is not None else [])
+
+def make_games(count: int) -> list[Game]:
+    now = datetime.now()
+    return [
+        Game(
+            uid=uuid.uuid4(),
+            title=f"Friday night game {i}",
+            game_time=now + timedelta(days=i % 30),
+            location="Lavin-Bernick Center",
+            buy_in=10 + i % 50,
+            host=f"host{i % 100}",
+            created_at=now,
+            updated_at=now,
+            version=1,
+        )
+        for i in range(count)
+    ]
+
+def build_app(games: list[Game]) -> FastAPI:
+    '''Same shape as the real routes: response_model for docs, ModelJSON for the body'''
+    app = FastAPI()
+    games_json = ModelJSON(List[Game])
+
+    @app.get("/games", response_model=List[Game])
+    async def list_games():
+        return games_json.render(games)
+
+    return app
+
+async def time_mode(client: httpx.AsyncClient, mode: str, repeat: int) -> dict:
+    Config.JSON_RESPONSE_MODE = mode
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = await client.get("/games")
+        samples.append((time.perf_counter() - start) * 1000)
+
+    return {
+        "p50_ms": round(statistics.median(samples), 3),
+        "min_ms": round(min(samples), 3),
+        "bytes": len(response.content),
+    }
+
+async def main(sizes: list[int], repeat: int) -> None:
+    report = {}
+    for size in sizes:
+        app = build_app(make_games(size))
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+            # Warm up imports and schema builds outside the timed runs
+            await client.get("/games")
+            report[size] = {mode: await time_mode(client, mode, repeat) for mode in MODES}
+
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1_000, 10_000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.sizes, args.repeat))
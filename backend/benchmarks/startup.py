@@ -0,0 +1,77 @@
+'''
+Measure cold start: how long a fresh interpreter takes to import src (which
+builds the app), and which packages that time goes to, from -X importtime.
+Each run is a new process, so nothing is served from an already-warm import.
+
+Runs without a database or Redis, connections are only opened by the lifespan:
+    python -m benchmarks.startup --repeat 10 --top 15 --output before.json
+'''
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from collections import defaultdict
+
+from .loadtest import SETTINGS_DEFAULTS, git_commit
+
+def import_times(env: dict) -> tuple[float, dict[str, float]]:
+    '''Total ms to import src, and self time per top-level package, from one fresh interpreter'''
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import src"],
+        env=env, capture_output=True, text=True, check=True
+    )
+
+    total = 0.0
+    packages: dict[str, float] = defaultdict(float)
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        name = name.strip()
+        packages[name.split(".")[0]] += int(self_us) / 1000
+        if name == "src":
+            total = int(cumulative_us) / 1000
+
+    return total, packages
+
+def main(args: argparse.Namespace) -> dict:
+    env = {**SETTINGS_DEFAULTS, **os.environ}
+    env.setdefault("DATABASE_URL", "sqlite+aiosqlite:///startup.sqlite")
+    env.setdefault("REDIS_HOST", "localhost")
+    env.setdefault("REDIS_PORT", "6379")
+
+    totals = []
+    packages: dict[str, list[float]] = defaultdict(list)
+    for _ in range(args.repeat):
+        total, per_package = import_times(env)
+        totals.append(total)
+        for name, ms in per_package.items():
+            packages[name].append(ms)
+
+    slowest = sorted(packages.items(), key=lambda item: statistics.median(item[1]), reverse=True)[:args.top]
+    return {
+        "commit": git_commit(),
+        "repeat": args.repeat,
+        "import_src_ms": {
+            "median": round(statistics.median(totals), 1),
+            "min": round(min(totals), 1),
+            "max": round(max(totals), 1),
+        },
+        "packages_self_ms": {name: round(statistics.median(samples), 1) for name, samples in slowest},
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="Packages to list, slowest first")
+    parser.add_argument("--output", help="Also write the report to this file")
+    args = parser.parse_args()
+
+    output = json.dumps(main(args), indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
@@ -0,0 +1,89 @@
+'''
+Seed a scratch copy of the users table and time the username/email lookups
+that every authenticated request goes through, before and after the unique
+indexes from migration 8a4e6d2c51b3 exist.
+
+Run from backend/ against a disposable Postgres:
+    python -m benchmarks.user_lookup --rows 1000000 --lookups 200
+'''
+import json
+import time
+import random
+import asyncio
+import argparse
+import statistics
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlmodel import text, create_engine
+
+from src.config import Config
+
+SCHEMA = "bench_user_lookup"
+
+async def seed(conn, rows: int) -> None:
+    '''Create a users clone in a throwaway schema and fill it server-side'''
+    await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+    await conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+    await conn.execute(text(f"CREATE TABLE {SCHEMA}.users (LIKE public.users INCLUDING DEFAULTS)"))
+    await conn.execute(text(f"""
+        INSERT INTO {SCHEMA}.users (uid, username, email, hashed_password, college, role, is_verified, created_at, updated_at)
+        SELECT gen_random_uuid(), 'u' || i, 'u' || i || '@tulane.edu', NULL, 'Tulane University', 'basic_user', true, now(), now()
+        FROM generate_series(1, :rows) AS i
+    """), {"rows": rows})
+    await conn.execute(text(f"ANALYZE {SCHEMA}.users"))
+
+async def time_lookups(conn, column: str, values: list[str]) -> dict:
+    '''Run one point lookup per value and summarize the latencies in ms'''
+    statement = text(f"SELECT * FROM {SCHEMA}.users WHERE {column} = :value")
+    samples = []
+    for value in values:
+        start = time.perf_counter()
+        (await conn.execute(statement, {"value": value})).first()
+        samples.append((time.perf_counter() - start) * 1000)
+
+    samples.sort()
+    return {
+        "p50_ms": round(statistics.median(samples), 3),
+        "p95_ms": round(samples[int(len(samples) * 0.95) - 1], 3),
+        "max_ms": round(samples[-1], 3),
+    }
+
+async def main(rows: int, lookups: int) -> None:
+    engine = AsyncEngine(create_engine(url=Config.DATABASE_URL))
+    ids = [random.randint(1, rows) for _ in range(lookups)]
+    usernames = [f"u{i}" for i in ids]
+    emails = [f"u{i}@tulane.edu" for i in ids]
+    report = {"rows": rows, "lookups": lookups}
+
+    try:
+        async with engine.begin() as conn:
+            await seed(conn, rows)
+
+        async with engine.connect() as conn:
+            report["before"] = {
+                "username": await time_lookups(conn, "username", usernames),
+                "email": await time_lookups(conn, "email", emails),
+            }
+
+        async with engine.begin() as conn:
+            await conn.execute(text(f"CREATE UNIQUE INDEX ON {SCHEMA}.users (username)"))
+            await conn.execute(text(f"CREATE UNIQUE INDEX ON {SCHEMA}.users (email)"))
+            await conn.execute(text(f"ANALYZE {SCHEMA}.users"))
+
+        async with engine.connect() as conn:
+            report["after"] = {
+                "username": await time_lookups(conn, "username", usernames),
+                "email": await time_lookups(conn, "email", emails),
+            }
+    finally:
+        async with engine.begin() as conn:
+            await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        await engine.dispose()
+
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--lookups", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main(args.rows, args.lookups))
@@ -0,0 +1,52 @@
+"""create users and games tables
+
+Revision ID: 3f1c2a9b7d10
+Revises: 
+Create Date: 2026-10-17 09:12:44.318207
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1c2a9b7d10'
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('users',
+    sa.Column('uid', postgresql.UUID(), nullable=False),
+    sa.Column('username', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('email', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('hashed_password', sa.LargeBinary(), nullable=True),
+    sa.Column('college', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('role', postgresql.VARCHAR(), server_default='basic_user', nullable=False),
+    sa.Column('is_verified', sa.Boolean(), nullable=False),
+    sa.Column('created_at', postgresql.TIMESTAMP(), nullable=True),
+    sa.Column('updated_at', postgresql.TIMESTAMP(), nullable=True),
+    sa.PrimaryKeyConstraint('uid')
+    )
+    op.create_table('games',
+    sa.Column('uid', postgresql.UUID(), nullable=False),
+    sa.Column('title', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('game_time', postgresql.TIMESTAMP(), nullable=True),
+    sa.Column('location', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('buy_in', sa.Integer(), nullable=False),
+    sa.Column('host', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('created_at', postgresql.TIMESTAMP(), nullable=True),
+    sa.Column('updated_at', postgresql.TIMESTAMP(), nullable=True),
+    sa.PrimaryKeyConstraint('uid')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('games')
+    op.drop_table('users')
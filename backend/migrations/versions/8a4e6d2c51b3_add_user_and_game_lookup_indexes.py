@@ -0,0 +1,40 @@
+"""add user and game lookup indexes
+
+Revision ID: 8a4e6d2c51b3
+Revises: 3f1c2a9b7d10
+Create Date: 2026-10-17 09:31:02.774519
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8a4e6d2c51b3'
+down_revision: Union[str, Sequence[str], None] = '3f1c2a9b7d10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CONCURRENTLY keeps the tables writable while the indexes build,
+    # but it cannot run inside the migration transaction.
+    # The unique builds fail if duplicate usernames/emails already exist.
+    with op.get_context().autocommit_block():
+        op.create_index('ix_users_username', 'users', ['username'], unique=True, postgresql_concurrently=True)
+        op.create_index('ix_users_email', 'users', ['email'], unique=True, postgresql_concurrently=True)
+        op.create_index('ix_games_created_at_uid', 'games', ['created_at', 'uid'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_games_game_time', 'games', ['game_time'], unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_games_game_time', table_name='games', postgresql_concurrently=True)
+        op.drop_index('ix_games_created_at_uid', table_name='games', postgresql_concurrently=True)
+        op.drop_index('ix_users_email', table_name='users', postgresql_concurrently=True)
+        op.drop_index('ix_users_username', table_name='users', postgresql_concurrently=True)
@@ -0,0 +1,30 @@
+"""add game version
+
+Revision ID: c72d1e5f9a44
+Revises: 8a4e6d2c51b3
+Create Date: 2026-10-17 11:04:26.503918
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = 'c72d1e5f9a44'
+down_revision: Union[str, Sequence[str], None] = '8a4e6d2c51b3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # A constant server default is a catalog-only change, existing rows start at version 1
+    op.add_column('games', sa.Column('version', postgresql.INTEGER(), server_default='1', nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('games', 'version')
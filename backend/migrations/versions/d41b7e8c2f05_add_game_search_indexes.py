@@ -0,0 +1,50 @@
+"""add game search indexes
+
+Revision ID: d41b7e8c2f05
+Revises: c72d1e5f9a44
+Create Date: 2026-10-17 14:22:51.190348
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = 'd41b7e8c2f05'
+down_revision: Union[str, Sequence[str], None] = 'c72d1e5f9a44'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('games', sa.Column('latitude', postgresql.DOUBLE_PRECISION(), nullable=True))
+    op.add_column('games', sa.Column('longitude', postgresql.DOUBLE_PRECISION(), nullable=True))
+    # earthdistance needs cube; both ship with Postgres contrib
+    op.execute('CREATE EXTENSION IF NOT EXISTS cube')
+    op.execute('CREATE EXTENSION IF NOT EXISTS earthdistance')
+
+    # Expressions must stay identical to SEARCH_VECTOR and GAME_POSITION in src/games/service.py
+    with op.get_context().autocommit_block():
+        op.execute("""
+            CREATE INDEX CONCURRENTLY ix_games_search ON games USING gin ((
+                setweight(to_tsvector('english'::regconfig, title), 'A') ||
+                setweight(to_tsvector('english'::regconfig, location), 'B')
+            ))
+        """)
+        op.execute("""
+            CREATE INDEX CONCURRENTLY ix_games_earth ON games USING gist (ll_to_earth(latitude, longitude))
+            WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+        """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_games_earth', table_name='games', postgresql_concurrently=True)
+        op.drop_index('ix_games_search', table_name='games', postgresql_concurrently=True)
+    op.drop_column('games', 'longitude')
+    op.drop_column('games', 'latitude')
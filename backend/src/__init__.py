@@ -1,16 +1,89 @@
-from fastapi import FastAPI
+import hmac
+import logging
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Header, HTTPException, Response, status
 
 from .config import Config
+from .middleware import CompressionMiddleware
+from .metrics import MetricsMiddleware, metrics_response
+from .db.query_budget import QueryBudgetMiddleware
+from .db.main import async_engine, replica_router, warm_pool, dispose_engines
+from .db.redis import redis_client, start_pubsub_listener, stop_pubsub_listener
+from .mail import mail_outbox
 from .auth.routes import auth_router
 from .games.routes import game_router
+from .internal.routes import internal_router
 
 api_version = Config.VERSION
 
-app = FastAPI(
-    title="PokerU Mobile App",
-    description="REST APIs for a college poker social media platform",
-    version=api_version
-)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    '''Pay connection setup before the first request instead of during it, and clean up on shutdown'''
+    await warm_pool(async_engine, Config.DB_POOL_WARM_CONNECTIONS)
+    for engine in replica_router.engines:
+        await warm_pool(engine, Config.DB_POOL_WARM_CONNECTIONS)
 
-app.include_router(auth_router, prefix=f"/api/{api_version}/auth", tags=['auth'])
-app.include_router(game_router, prefix=f"/api/{api_version}/games", tags=['games'])
\ No newline at end of file
+    # A Redis outage shouldn't keep the worker from booting, requests retry on their own
+    try:
+        await redis_client.ping()
+    except Exception as e:
+        logging.warning("Redis unavailable at startup: %s", e)
+
+    start_pubsub_listener()
+    if Config.MAIL_WORKER_IN_PROCESS:
+        mail_outbox.start_worker()
+
+    yield
+
+    await mail_outbox.stop_worker()
+    await stop_pubsub_listener()
+    await redis_client.aclose()
+    await dispose_engines()
+
+def create_app() -> FastAPI:
+    '''Build the API with its middleware, routers and startup/shutdown hooks'''
+    app = FastAPI(
+        title="PokerU Mobile App",
+        description="REST APIs for a college poker social media platform",
+        version=api_version,
+        lifespan=lifespan
+    )
+
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=Config.COMPRESSION_MINIMUM_SIZE,
+        gzip_level=Config.COMPRESSION_GZIP_LEVEL,
+        brotli_quality=Config.COMPRESSION_BROTLI_QUALITY
+    )
+
+    if Config.QUERY_BUDGET_MODE != "off" or Config.QUERY_REPEAT_THRESHOLD:
+        app.add_middleware(
+            QueryBudgetMiddleware,
+            mode=Config.QUERY_BUDGET_MODE,
+            repeat_threshold=Config.QUERY_REPEAT_THRESHOLD
+        )
+
+    app.include_router(auth_router, prefix=f"/api/{api_version}/auth", tags=['auth'])
+    app.include_router(game_router, prefix=f"/api/{api_version}/games", tags=['games'])
+    app.include_router(internal_router, prefix=f"/api/{api_version}/internal", tags=['internal'])
+
+    if Config.METRICS_ENABLED:
+        # Outermost, so compression counts toward request latency
+        app.add_middleware(MetricsMiddleware, server_timing=Config.METRICS_SERVER_TIMING)
+
+        @app.get("/metrics", include_in_schema=False)
+        async def metrics(authorization: str = Header(default="")):
+            '''Prometheus scrape endpoint, only for scrapers holding METRICS_TOKEN'''
+            expected = f"Bearer {Config.METRICS_TOKEN}".encode('utf-8')
+            if not Config.METRICS_TOKEN or not hmac.compare_digest(authorization.encode('utf-8'), expected):
+                raise HTTPException(
+                    status_code=status.HTTP_403_FORBIDDEN,
+                    detail="Not allowed to read metrics"
+                )
+
+            body, content_type = metrics_response()
+            return Response(content=body, media_type=content_type)
+
+    return app
+
+app = create_app()
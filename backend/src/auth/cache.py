@@ -0,0 +1,69 @@
+import json
+import uuid
+from src.cache import TTLCache
+from src.config import Config
+from src.db.redis import redis_client, publish, subscribe, start_pubsub_listener
+
+from .models import User
+
+USER_INVALIDATION_CHANNEL = "user-cache:invalidate"
+
+class UserCache:
+    '''Two-tier identity cache: an in-process TTL/LRU in front of Redis'''
+    def __init__(self) -> None:
+        self.local = TTLCache(maxsize=Config.USER_CACHE_SIZE, ttl=Config.USER_CACHE_LOCAL_TTL)
+
+    @staticmethod
+    def uid_key(uid: str | uuid.UUID) -> str:
+        return f"user:uid:{uid}"
+
+    @staticmethod
+    def username_key(username: str) -> str:
+        return f"user:username:{username}"
+
+    async def get(self, key: str) -> User | None:
+        '''Look up a user in the local tier, then in Redis'''
+        start_pubsub_listener()
+
+        user = self.local.get(key)
+        if user is not None:
+            return user
+
+        cached = await redis_client.get(key)
+        if cached is None:
+            return None
+
+        # The hash is never cached, so identity lookups can't be used to check passwords
+        user = User.model_validate(json.loads(cached), update={"hashed_password": b""})
+        self.store_local(user)
+        return user
+
+    async def set(self, user: User) -> None:
+        '''Cache a user under both its uid and username keys'''
+        self.store_local(user)
+
+        # hashed_password is excluded from the dump, so it never leaves the DB
+        payload = user.model_dump_json()
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.set(self.uid_key(user.uid), payload, ex=Config.USER_CACHE_REDIS_TTL)
+            pipe.set(self.username_key(user.username), payload, ex=Config.USER_CACHE_REDIS_TTL)
+            await pipe.execute()
+
+    def store_local(self, user: User) -> None:
+        self.local.set(self.uid_key(user.uid), user)
+        self.local.set(self.username_key(user.username), user)
+
+    def evict_local(self, message: dict) -> None:
+        '''Drop a user from this worker's local tier'''
+        self.local.pop(self.uid_key(message["uid"]))
+        self.local.pop(self.username_key(message["username"]))
+
+    async def invalidate(self, uid: str | uuid.UUID, username: str) -> None:
+        '''Forget a user here, in Redis and on every other worker'''
+        message = {"uid": str(uid), "username": username}
+        self.evict_local(message)
+        await redis_client.delete(self.uid_key(uid), self.username_key(username))
+        await publish(USER_INVALIDATION_CHANNEL, message)
+
+user_cache = UserCache()
+subscribe(USER_INVALIDATION_CHANNEL, user_cache.evict_local)
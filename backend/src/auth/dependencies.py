@@ -1,3 +1,4 @@
+import math
 from typing import Any, List
 from fastapi.security import HTTPBearer
 from fastapi.exceptions import HTTPException
@@ -5,11 +6,11 @@ from fastapi import status, Request, Depends
 from fastapi.security.http import HTTPAuthorizationCredentials
 from sqlmodel.ext.asyncio.session import AsyncSession
 
-from src.db.redis import token_in_blocklist
+from src.db.redis import token_in_blocklist, token_generations, consume_rate_limit
 from src.db.main import get_session
 
 from .service import AuthService
-from .utils import decode_token
+from .utils import decode_token_cached
 from .models import User
 
 auth_service = AuthService()
@@ -32,8 +33,17 @@ class TokenBearer(HTTPBearer):
                 }
             )
         
-        token = creds.credentials
-        token_data = decode_token(token)
+        token_data = await self.validate_token(creds.credentials)
+
+        # Let later dependencies (e.g. replica routing) know who is calling
+        request.state.token_data = token_data
+
+        # Return decoded token
+        return token_data
+
+    async def validate_token(self, token: str) -> dict:
+        '''Decode a raw JWT and run every validity check (shared with WebSocket auth)'''
+        token_data = decode_token_cached(token)
 
         # Invalid or expired token
         if token_data is None:
@@ -55,10 +65,20 @@ class TokenBearer(HTTPBearer):
                 }
             )
 
+        # Token minted before the user's last "log out everywhere"
+        current_generation = await token_generations.get(token_data["user"]["user_uid"])
+        if token_data.get("gen", 0) < current_generation:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail={
+                    "error": "Invalid or revoked token",
+                    "resolution": "Please get a new token"
+                }
+            )
+
         # Verify a valid access/refresh token
         self.verify_token_data(token_data)
 
-        # Return decoded token
         return token_data
     
     def verify_token_data(self, token_data: dict):
@@ -91,9 +111,9 @@ async def get_current_user(
     session: AsyncSession = Depends(get_session),
     token_details: dict = Depends(AccessTokenBearer())
 ):
-    '''Get current user data (username) based on their access token'''
-    username = token_details["user"]["username"]
-    user = await auth_service.get_user_by_username(username, session)
+    '''Get current user data based on their access token, served from the identity cache'''
+    user_uid = token_details["user"]["user_uid"]
+    user = await auth_service.get_cached_user_by_uid(user_uid, session)
     return user
 
 class RoleChecker():
@@ -119,4 +139,37 @@ class RoleChecker():
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not allowed to perform this action"
         )
-  
\ No newline at end of file
+
+class RateLimiter():
+    '''Token-bucket rate limit keyed by client IP plus identifying fields of the JSON body'''
+    def __init__(self, scope: str, budget: str, body_fields: List[str] | None = None) -> None:
+        requests, seconds = budget.split("/")
+        self.scope = scope
+        self.capacity = int(requests)
+        self.refill_per_second = int(requests) / int(seconds)
+        self.body_fields = body_fields or []
+
+    async def __call__(self, request: Request) -> None:
+        '''Spend one token from every bucket this request maps to, or reject with 429'''
+        client_ip = request.client.host if request.client else "unknown"
+        keys = [f"ratelimit:{self.scope}:ip:{client_ip}"]
+
+        # FastAPI has already read the body, so this hits the cached copy
+        if self.body_fields:
+            try:
+                body = await request.json()
+            except ValueError:
+                body = {}
+
+            for field in self.body_fields:
+                value = body.get(field) if isinstance(body, dict) else None
+                if isinstance(value, str) and value:
+                    keys.append(f"ratelimit:{self.scope}:{field}:{value.lower()}")
+
+        allowed, wait = await consume_rate_limit(keys, self.capacity, self.refill_per_second)
+        if not allowed:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests, please try again later",
+                headers={"Retry-After": str(math.ceil(wait))}
+            )
@@ -19,8 +19,8 @@ class User(SQLModel, table=True):
             default=uuid.uuid4
         )
     )
-    username: str
-    email: str
+    username: str = Field(unique=True, index=True)
+    email: str = Field(unique=True, index=True)
     hashed_password: bytes = Field(sa_column=Column(LargeBinary), exclude=True)
     college: str
     role: str = Field(
@@ -1,30 +1,42 @@
+from typing import Any, List, Optional
 from datetime import timedelta, datetime
 from fastapi.responses import JSONResponse
 from fastapi.exceptions import HTTPException
 from fastapi import status, APIRouter, Depends
+from sqlalchemy.exc import IntegrityError
 from sqlmodel.ext.asyncio.session import AsyncSession
 
 from src.config import Config
 from src.db.main import get_session
-from src.db.redis import add_jti_to_blocklist
+from src.db.query_budget import QueryBudget
+from src.db.redis import add_jti_to_blocklist, token_generations, reserve_verification_email
 from src.mail import send_message, EmailModel
+from src.responses import ModelJSON, NegotiatedRoute, SparseFields
 
 from .models import User
 from .service import AuthService
-from .dependencies import get_current_user, RoleChecker, RefreshTokenBearer, AccessTokenBearer
+from .dependencies import get_current_user, RoleChecker, RefreshTokenBearer, AccessTokenBearer, RateLimiter
 from .schemas import UserCreateModel, UserLoginModel, PasswordResetRequestModel, PasswordResetConfirmModel, ProfileUpdateModel
-from .utils import check_valid_email, verify_passsword, generate_hashed_pwd, create_token, create_url_safe_token, decode_url_safe_token
+from .utils import check_valid_email, verify_passsword_async, generate_hashed_pwd_async, create_token, create_url_safe_token, decode_url_safe_token
 
-auth_router = APIRouter()
+auth_router = APIRouter(route_class=NegotiatedRoute)
 auth_service = AuthService()
 access_token_bearer = AccessTokenBearer()
 refresh_token_bearer = RefreshTokenBearer()
 role_checker = RoleChecker(["admin", "staff", "premium_user", "basic_user"])
+signup_rate_limit = RateLimiter("signup", Config.RATE_LIMIT_SIGNUP, ["email", "username"])
+login_rate_limit = RateLimiter("login", Config.RATE_LIMIT_LOGIN, ["username"])
+password_reset_request_rate_limit = RateLimiter("password-reset-request", Config.RATE_LIMIT_PASSWORD_RESET_REQUEST, ["email"])
+password_reset_confirm_rate_limit = RateLimiter("password-reset-confirm", Config.RATE_LIMIT_PASSWORD_RESET_CONFIRM)
+user_json = ModelJSON(User)
+sparse_user_json = ModelJSON(dict[str, Any], matches_response_model=False)
+user_fields = SparseFields(User)
 
 @auth_router.post(
     "/signup",
     response_model=User,
-    status_code=status.HTTP_201_CREATED
+    status_code=status.HTTP_201_CREATED,
+    dependencies=[Depends(signup_rate_limit), Depends(QueryBudget(2))]
 )
 async def create_user_account(
     user_data: UserCreateModel,
@@ -38,19 +50,18 @@ async def create_user_account(
             detail="Please fill in all required fields"
         )
         
-    # Email already exists
+    # Email or username already exists, checked in one query
     email = user_data.email
-    user_exists = await auth_service.email_exists(email, session)
-    if user_exists:
+    username = user_data.username
+    email_taken, username_taken = await auth_service.find_taken(email, username, session)
+    if email_taken:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="User with email already exists"
         )
     
     # Username already exists
-    username = user_data.username
-    user_exists = await auth_service.username_exists(username, session)
-    if user_exists:
+    if username_taken:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="User with username already exists"
@@ -75,7 +86,7 @@ async def create_user_account(
 
     return new_user
 
-@auth_router.post("/login")
+@auth_router.post("/login", dependencies=[Depends(login_rate_limit), Depends(QueryBudget(1))])
 async def login_user(
     login_data: UserLoginModel,
     session: AsyncSession = Depends(get_session)
@@ -100,7 +111,7 @@ async def login_user(
         )
     
     # Invalid password
-    valid_password = verify_passsword(password, db_user.hashed_password)
+    valid_password = await verify_passsword_async(password, db_user.hashed_password)
     if not valid_password:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -112,29 +123,35 @@ async def login_user(
         # Create the token to include in the URL of verification email
         user_email = db_user.email
         token = create_url_safe_token({"email": user_email})
-        link = f"http://{Config.DOMAIN}/api/v1/auth/verify/{token}"
-        html_message = f"""
-            <h1>Verify Your Email</h1>
-            <p>Please click <a href='{link}'>this link</a>to verify your email</p>
-        """
-                
-        # Send verification email
-        recipients = [user_email]
-        subject = "Thanks for Joining PokerU! Verify Your Email Here!"
-        await send_message(recipients, subject, html_message)
+
+        # Only the first attempt in the debounce window sends; later ones reuse the pending email
+        pending_token = await reserve_verification_email(user_email, token)
+        if pending_token is None:
+            link = f"http://{Config.DOMAIN}/api/v1/auth/verify/{token}"
+            html_message = f"""
+                <h1>Verify Your Email</h1>
+                <p>Please click <a href='{link}'>this link</a>to verify your email</p>
+            """
+                    
+            # Send verification email
+            recipients = [user_email]
+            subject = "Thanks for Joining PokerU! Verify Your Email Here!"
+            await send_message(recipients, subject, html_message)
 
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Please verify your account through the email we sent you before logging in"
         )
     
-    # Generate access & refresh tokens
+    # Generate access & refresh tokens stamped with the user's current token generation
+    generation = await token_generations.get(str(db_user.uid))
     access_token = create_token(
         user_data = {
             "username": username,
             "user_uid": str(db_user.uid),
             "role": db_user.role, 
-        }
+        },
+        generation=generation
     )
 
     refresh_token = create_token(
@@ -144,7 +161,8 @@ async def login_user(
             "role": db_user.role,
         },
         refresh=True,
-        expiry=timedelta(days=Config.REFRESH_TOKEN_EXPIRY)
+        expiry=timedelta(days=Config.REFRESH_TOKEN_EXPIRY),
+        generation=generation
     )
 
     return JSONResponse(
@@ -171,7 +189,18 @@ async def revoke_token(token_details: dict = Depends(access_token_bearer)):
         status_code=status.HTTP_200_OK
     )
 
-@auth_router.get("/verify/{token}")
+@auth_router.get("/logout-all")
+async def revoke_all_tokens(token_details: dict = Depends(access_token_bearer)):
+    '''Revoke every access and refresh token of the user with one counter bump'''
+    await token_generations.bump(token_details["user"]["user_uid"])
+    return JSONResponse(
+        content={
+            "message": "Logged out of all sessions successfully"
+        },
+        status_code=status.HTTP_200_OK
+    )
+
+@auth_router.get("/verify/{token}", dependencies=[Depends(QueryBudget(2))])
 async def verify_user_account(
     token: str,
     session: AsyncSession = Depends(get_session)
@@ -202,14 +231,18 @@ async def verify_user_account(
         content={"message": "Error occured during verification"}
     )
 
-@auth_router.get("/me", response_model=User)
+@auth_router.get("/me", response_model=User, dependencies=[Depends(QueryBudget(1))])
 async def get_active_user(
+    fields: Optional[List[str]] = Depends(user_fields),
     user_details: dict = Depends(get_current_user)
 ):
-    '''Get current active user's data'''
-    return user_details
+    '''Get current active user's data, optionally only some fields'''
+    if fields is None:
+        return user_json.render(user_details)
+
+    return sparse_user_json.render(user_details.model_dump(include=set(fields)))
 
-@auth_router.post("/password-reset-request")
+@auth_router.post("/password-reset-request", dependencies=[Depends(password_reset_request_rate_limit)])
 async def request_password_reset(email_data: PasswordResetRequestModel):
     '''Send a password reset link to the user email'''
     # Get user email and init the mail's recipients + subject
@@ -235,7 +268,10 @@ async def request_password_reset(email_data: PasswordResetRequestModel):
         }
     )
 
-@auth_router.post("/password-reset-confirm/{token}")
+@auth_router.post(
+    "/password-reset-confirm/{token}",
+    dependencies=[Depends(password_reset_confirm_rate_limit), Depends(QueryBudget(2))]
+)
 async def reset_account_password(
     token: str,
     password_form: PasswordResetConfirmModel,
@@ -274,7 +310,11 @@ async def reset_account_password(
             )
                 
         # Update user new password with hased value
-        await auth_service.update_user(user, {"hashed_password": generate_hashed_pwd(password)}, session)
+        hashed_password = await generate_hashed_pwd_async(password)
+        await auth_service.update_user(user, {"hashed_password": hashed_password}, session)
+
+        # Kill every session that was opened with the old password
+        await token_generations.bump(str(user.uid))
 
         return JSONResponse(
             status_code=status.HTTP_200_OK,
@@ -288,7 +328,7 @@ async def reset_account_password(
 
 @auth_router.patch(
     "/edit-profile",
-    dependencies=[Depends(role_checker)]
+    dependencies=[Depends(role_checker), Depends(QueryBudget(2))]
 )
 async def update_profile(
     new_profile: ProfileUpdateModel,
@@ -303,33 +343,29 @@ async def update_profile(
             detail="Please fill in all required fields"
     )
         
-    # Username is not unique
+    # Update the user get_current_user already loaded with new field value (username, etc.)
     new_username = new_profile.username
-    user_exists = await auth_service.username_exists(new_username, session)
-    if user_exists and new_username != user_details.username:
+    try:
+        user = await auth_service.update_user(
+            user_details,
+            {
+                "username": new_username
+            },
+            session
+        )
+    except IntegrityError:
+        # Username is not unique
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail='User with username already exists'
         )
 
-    # Find user in DB
-    user = await auth_service.get_user_by_email(user_details.email, session)
-
     # User not found in db
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User not found"
         )
-        
-    # Update user profile with new field value (username, etc.)
-    await auth_service.update_user(
-        user,
-        {
-            "username": new_username
-        },
-        session
-    )
 
     return JSONResponse(
         status_code=status.HTTP_200_OK,
@@ -338,7 +374,7 @@ async def update_profile(
 
 @auth_router.delete(
     "/delete-account",
-    dependencies=[Depends(role_checker)]
+    dependencies=[Depends(role_checker), Depends(QueryBudget(2))]
 )
 async def delete_user_account(
     session: AsyncSession = Depends(get_session),
@@ -354,6 +390,9 @@ async def delete_user_account(
             detail="User not found"
         )
 
+    # Outstanding tokens must not outlive the account
+    await token_generations.bump(str(user_details.uid))
+
     return JSONResponse(
         status_code=status.HTTP_200_OK,
         content={"message": "Account deleted successfully"}
@@ -367,7 +406,8 @@ async def get_new_access_token(token_details: dict = Depends(refresh_token_beare
     # Create a new access token once previous refresh token is expired
     if datetime.fromtimestamp(expiry_timestamp) > datetime.now():
         new_access_token = create_token(
-            user_data=token_details["user"]
+            user_data=token_details["user"],
+            generation=token_details.get("gen", 0)
         )
                 
         return JSONResponse(content={
@@ -1,9 +1,11 @@
-from sqlmodel import select
+import uuid
+from sqlmodel import select, update, delete, or_
 from sqlmodel.ext.asyncio.session import AsyncSession
 
+from .cache import user_cache
 from .models import User
 from .schemas import UserCreateModel
-from .utils import generate_hashed_pwd, get_college_by_email
+from .utils import generate_hashed_pwd_async, get_college_by_email
 
 class AuthService:
     async def get_user_by_email(self, email: str, session: AsyncSession):
@@ -22,6 +24,34 @@ class AuthService:
         user = result.first()
         return user
     
+    async def get_user_by_uid(self, uid: str, session: AsyncSession):
+        '''Return a user based on their uid'''
+        statement = select(User).where(User.uid == uuid.UUID(str(uid)))
+        result = await session.exec(statement)
+
+        user = result.first()
+        return user
+
+    async def get_cached_user_by_uid(self, uid: str, session: AsyncSession):
+        '''Read-through identity lookup by uid (local cache -> Redis -> DB)'''
+        user = await user_cache.get(user_cache.uid_key(uid))
+        if user is None:
+            user = await self.get_user_by_uid(uid, session)
+            if user is not None:
+                await user_cache.set(user)
+
+        return user
+
+    async def get_cached_user_by_username(self, username: str, session: AsyncSession):
+        '''Read-through identity lookup by username (local cache -> Redis -> DB)'''
+        user = await user_cache.get(user_cache.username_key(username))
+        if user is None:
+            user = await self.get_user_by_username(username, session)
+            if user is not None:
+                await user_cache.set(user)
+
+        return user
+    
     async def email_exists(self, email: str, session: AsyncSession):
         '''Check if user email exists in DB'''
         user = await self.get_user_by_email(email, session)
@@ -32,34 +62,51 @@ class AuthService:
         user = await self.get_user_by_username(username, session)
         return True if (user is not None) else False
 
+    async def find_taken(self, email: str, username: str, session: AsyncSession) -> tuple[bool, bool]:
+        '''Check whether the email and the username are registered, in one query'''
+        statement = select(User.email, User.username).where(or_(User.email == email, User.username == username))
+        result = await session.exec(statement)
+
+        rows = result.all()
+        return any(row.email == email for row in rows), any(row.username == username for row in rows)
+
     async def create_user(self, user_data: UserCreateModel, session: AsyncSession):
         '''Add a new user to DB'''
         user_data_dict = user_data.model_dump()
         new_user = User(
             **user_data_dict
         )
-        new_user.hashed_password = generate_hashed_pwd(user_data_dict["password"])
+        new_user.hashed_password = await generate_hashed_pwd_async(user_data_dict["password"])
         new_user.college = get_college_by_email(user_data_dict["email"])
         new_user.role = "basic_user"
 
         session.add(new_user)
         await session.commit()
-        session.refresh(new_user)
         return new_user
 
     async def update_user(self, db_user: User, user_data: dict, session: AsyncSession):
         '''Update an user based on updated fields'''
-        for key, val in user_data.items():
-            setattr(db_user, key, val)
+        # Remember the keys the user is cached under before they change
+        uid, old_username = db_user.uid, db_user.username
+
+        # Update by uid, the user may come detached from the identity cache
+        statement = update(User).where(User.uid == uid).values(**user_data).returning(User)
+        result = await session.exec(statement)
+        updated_user = result.scalars().first()
 
         await session.commit()
-        session.refresh(db_user)
-        return db_user
+        await user_cache.invalidate(uid, old_username)
+        return updated_user
 
     async def delete_user(self, user_to_delete: User, session: AsyncSession):
         if user_to_delete is not None:
-            await session.delete(user_to_delete)
+            # Delete by uid, the user may come detached from the identity cache
+            statement = delete(User).where(User.uid == user_to_delete.uid)
+            result = await session.exec(statement)
             await session.commit()
-            return "User deleted successfully"
+
+            await user_cache.invalidate(user_to_delete.uid, user_to_delete.username)
+            if result.rowcount:
+                return "User deleted successfully"
 
         return None
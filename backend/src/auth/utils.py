@@ -1,11 +1,17 @@
 import re
+import time
 import uuid
+import asyncio
+import hashlib
 import logging
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
 from datetime import datetime, timezone, timedelta
 from itsdangerous import URLSafeTimedSerializer
 import bcrypt
 import jwt
 
+from src.cache import TTLCache
+from src.metrics import timed, HASH_QUEUE_DEPTH, HASH_IN_FLIGHT
 from src.config import Config
 from .models import domain_of_college
 
@@ -26,6 +32,65 @@ def verify_passsword(plain_password: str, hashed_password: bytes) -> bool:
         hashed_password
     )
 
+class HashPool:
+    '''Bounded worker pool that keeps bcrypt off the event loop'''
+    def __init__(self, kind: str, workers: int, max_concurrency: int) -> None:
+        self.kind = kind
+        self.workers = workers
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.executor: Executor | None = None
+        self.queue_depth = 0
+        self.in_flight = 0
+
+    def get_executor(self) -> Executor:
+        '''Create the thread/process pool on first use'''
+        if self.executor is None:
+            if self.kind == "process":
+                self.executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+
+        return self.executor
+
+    async def run(self, func, *args):
+        '''Wait for a free slot, then run func(*args) on the pool'''
+        self.queue_depth += 1
+        HASH_QUEUE_DEPTH.inc()
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.queue_depth -= 1
+            HASH_QUEUE_DEPTH.dec()
+
+        self.in_flight += 1
+        HASH_IN_FLIGHT.inc()
+        try:
+            loop = asyncio.get_running_loop()
+            with timed("bcrypt"):
+                return await loop.run_in_executor(self.get_executor(), func, *args)
+        finally:
+            self.in_flight -= 1
+            HASH_IN_FLIGHT.dec()
+            self.semaphore.release()
+
+    def stats(self) -> dict:
+        '''Current queue depth and in-flight hashing jobs'''
+        return {"queue_depth": self.queue_depth, "in_flight": self.in_flight}
+
+hash_pool = HashPool(
+    kind=Config.PASSWORD_HASH_EXECUTOR,
+    workers=Config.PASSWORD_HASH_WORKERS,
+    max_concurrency=Config.PASSWORD_HASH_MAX_CONCURRENCY
+)
+
+async def generate_hashed_pwd_async(password: str) -> bytes:
+    '''Hash password on the bcrypt pool without blocking the event loop'''
+    return await hash_pool.run(generate_hashed_pwd, password)
+
+async def verify_passsword_async(plain_password: str, hashed_password: bytes) -> bool:
+    '''Compare plain and hashed password on the bcrypt pool'''
+    return await hash_pool.run(verify_passsword, plain_password, hashed_password)
+
 REGEX = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,7}\b'
 def get_email_domain(email: str):
     '''Separate the email domain after @'''
@@ -49,13 +114,14 @@ def check_valid_email(email: str):
 
     return True
 
-def create_token(user_data: dict, expiry: timedelta = None, refresh: bool = False):
-    '''Create an access token for an user based on their data and expiration time'''
+def create_token(user_data: dict, expiry: timedelta = None, refresh: bool = False, generation: int = 0):
+    '''Create an access token for an user based on their data, expiration time and token generation'''
     to_encode = {}
     to_encode['user'] = user_data
     to_encode['exp'] = datetime.now(timezone.utc) + (expiry if expiry else timedelta(minutes=Config.ACCESS_TOKEN_EXPIRY))
     to_encode['jti'] = str(uuid.uuid4())
     to_encode['refresh'] = refresh
+    to_encode['gen'] = generation
 
     token = jwt.encode(
         payload=to_encode,
@@ -79,6 +145,22 @@ def decode_token(token: str) -> dict:
         logging.exception(e)
         return None
 
+# Decoded claims keyed by token digest, each entry evicted when its token expires
+claims_cache = TTLCache(maxsize=Config.TOKEN_CLAIMS_CACHE_SIZE, ttl=Config.ACCESS_TOKEN_EXPIRY * 60)
+
+def decode_token_cached(token: str) -> dict:
+    '''Get user data based on JWT token, skipping the signature check for recently seen tokens'''
+    digest = hashlib.sha256(token.encode('utf-8')).digest()
+    token_data = claims_cache.get(digest)
+    if token_data is not None:
+        return token_data
+
+    token_data = decode_token(token)
+    if token_data is not None:
+        claims_cache.set(digest, token_data, ttl=token_data["exp"] - time.time())
+
+    return token_data
+
 serializer = URLSafeTimedSerializer(
     secret_key=Config.JWT_SECRET,
     salt="email-configuration"
@@ -1,6 +1,17 @@
+from typing import Optional
+from pydantic import model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
+# Per ENVIRONMENT: (QUERY_BUDGET_MODE, QUERY_REPEAT_THRESHOLD) when they aren't set explicitly
+QUERY_CHECK_DEFAULTS = {
+    "development": ("warn", 2),
+    "test": ("raise", 2),
+    "production": ("off", 0),
+}
+
 class Settings(BaseSettings):
+    # "development", "test" or "production"
+    ENVIRONMENT: str = "production"
     DOMAIN: str
     VERSION: str
     DATABASE_URL: str
@@ -12,7 +23,81 @@ class Settings(BaseSettings):
     REDIS_PORT: int
     REDIS_HOST: str
     RESEND_API_KEY: str
+    GAMES_PAGE_SIZE_DEFAULT: int = 20
+    GAMES_PAGE_SIZE_MAX: int = 100
+    PASSWORD_HASH_EXECUTOR: str = "thread"
+    PASSWORD_HASH_WORKERS: int = 4
+    PASSWORD_HASH_MAX_CONCURRENCY: int = 8
+    USER_CACHE_SIZE: int = 10000
+    USER_CACHE_LOCAL_TTL: int = 30
+    USER_CACHE_REDIS_TTL: int = 300
+    TOKEN_CLAIMS_CACHE_SIZE: int = 10000
+    BLOCKLIST_FILTER_CAPACITY: int = 100000
+    BLOCKLIST_FILTER_ERROR_RATE: float = 0.001
+    BLOCKLIST_FILTER_REBUILD_INTERVAL: int = 60
+    TOKEN_GENERATION_CACHE_TTL: int = 30
+    DB_ECHO: bool = False
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: int = 30
+    DB_POOL_PRE_PING: bool = True
+    DB_POOL_RECYCLE: int = 1800
+    DB_STATEMENT_TIMEOUT: int = 30000
+    # Connections each engine opens at startup, so the first requests don't pay for connecting
+    DB_POOL_WARM_CONNECTIONS: int = 2
+    SLOW_QUERY_MS: float = 200
+    SLOW_QUERY_EXPLAIN_SAMPLE_RATE: float = 0.0
+    SLOW_QUERY_LOG_SIZE: int = 100
+    # What to do when a request runs more statements than its route's QueryBudget: "off", "warn" or "raise";
+    # unset follows ENVIRONMENT
+    QUERY_BUDGET_MODE: Optional[str] = None
+    # Warn when one statement shape runs this many times in a request (0 disables); unset follows ENVIRONMENT
+    QUERY_REPEAT_THRESHOLD: Optional[int] = None
+    DATABASE_REPLICA_URLS: list[str] = []
+    REPLICA_RETRY_AFTER: int = 30
+    READ_YOUR_WRITES_TTL: int = 5
+    MAIL_PROVIDER: str = "resend"
+    MAIL_FILE_PATH: str = "outbox.jsonl"
+    MAIL_WORKER_IN_PROCESS: bool = True
+    MAIL_WORKER_CONCURRENCY: int = 4
+    MAIL_MAX_ATTEMPTS: int = 5
+    MAIL_RETRY_BASE_DELAY: int = 2
+    MAIL_RETRY_MAX_DELAY: int = 300
+    # A worker that hasn't refreshed its heartbeat for this long is presumed dead and its claims requeued
+    MAIL_WORKER_HEARTBEAT_TTL: int = 30
+    VERIFY_EMAIL_DEBOUNCE: int = 600
+    GAMES_WS_QUEUE_SIZE: int = 100
+    # Seconds between re-validating a socket's token, so revoked sessions stop receiving events
+    GAMES_WS_TOKEN_RECHECK_INTERVAL: int = 30
+    GAMES_LIST_CACHE_TTL: int = 60
+    GAMES_LIST_CACHE_LOCK_TIMEOUT: float = 2.0
+    GAMES_BULK_MAX: int = 500
+    GAMES_SEARCH_RADIUS_KM: float = 10
+    GAMES_SEARCH_RADIUS_KM_MAX: float = 100
+    # "standard" validates responses against response_model; "pydantic" or "orjson" skip that
+    JSON_RESPONSE_MODE: str = "standard"
+    COMPRESSION_MINIMUM_SIZE: int = 1024
+    COMPRESSION_GZIP_LEVEL: int = 6
+    COMPRESSION_BROTLI_QUALITY: int = 4
+    METRICS_ENABLED: bool = False
+    # Bearer token Prometheus must send to scrape /metrics; unset keeps the endpoint closed
+    METRICS_TOKEN: str = ""
+    METRICS_SERVER_TIMING: bool = False
+    # Rate limit budgets as "<requests>/<seconds>"
+    RATE_LIMIT_LOGIN: str = "10/60"
+    RATE_LIMIT_SIGNUP: str = "5/300"
+    RATE_LIMIT_PASSWORD_RESET_REQUEST: str = "3/300"
+    RATE_LIMIT_PASSWORD_RESET_CONFIRM: str = "5/300"
     
+    @model_validator(mode="after")
+    def apply_environment_defaults(self) -> "Settings":
+        budget_mode, repeat_threshold = QUERY_CHECK_DEFAULTS.get(self.ENVIRONMENT, QUERY_CHECK_DEFAULTS["production"])
+        if self.QUERY_BUDGET_MODE is None:
+            self.QUERY_BUDGET_MODE = budget_mode
+        if self.QUERY_REPEAT_THRESHOLD is None:
+            self.QUERY_REPEAT_THRESHOLD = repeat_threshold
+        return self
+
     model_config = SettingsConfigDict(
         env_file=".env",
         extra="ignore"
@@ -1,14 +1,140 @@
+import time
+import asyncio
+import logging
+import itertools
+from fastapi import Request
+from sqlalchemy import make_url
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlalchemy.ext.asyncio import AsyncEngine
 from sqlmodel import text, create_engine, SQLModel
 from sqlmodel.ext.asyncio.session import AsyncSession
 
 from src.config import Config
+from src.db.redis import redis_client
+# Imported for its listeners, which log slow statements on every engine
+from src.db import slow_query
 
-async_engine = AsyncEngine(create_engine(
-    url=Config.DATABASE_URL,
-    echo=True
-))
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    '''Connection pool that also tracks how long checkouts wait for a connection'''
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            wait = time.perf_counter() - start
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def recreate(self):
+        # Keep the wait stats across pool resets (e.g. after a failed pre-ping)
+        pool = super().recreate()
+        pool.checkouts, pool.total_wait, pool.max_wait = self.checkouts, self.total_wait, self.max_wait
+        return pool
+
+def get_connect_args(url: str) -> dict:
+    '''Driver-level connection settings (statement timeout is enforced by Postgres)'''
+    if make_url(url).get_driver_name() == "asyncpg" and Config.DB_STATEMENT_TIMEOUT:
+        return {"server_settings": {"statement_timeout": str(Config.DB_STATEMENT_TIMEOUT)}}
+
+    return {}
+
+def build_engine(url: str) -> AsyncEngine:
+    '''Create an async engine with the pool settings from Config'''
+    return AsyncEngine(create_engine(
+        url=url,
+        echo=Config.DB_ECHO,
+        poolclass=TimedQueuePool,
+        pool_size=Config.DB_POOL_SIZE,
+        max_overflow=Config.DB_MAX_OVERFLOW,
+        pool_timeout=Config.DB_POOL_TIMEOUT,
+        pool_pre_ping=Config.DB_POOL_PRE_PING,
+        pool_recycle=Config.DB_POOL_RECYCLE,
+        connect_args=get_connect_args(url)
+    ))
+
+class PrimarySession(AsyncSession):
+    '''Session on the primary that pins its client to the primary as soon as a commit succeeds'''
+    async def commit(self) -> None:
+        await super().commit()
+
+        # Before the response goes out, or the client's next read could still hit a lagging replica
+        request = self.info.get("request")
+        if request is not None and replica_router.engines:
+            try:
+                await redis_client.set(read_your_writes_key(request), 1, ex=Config.READ_YOUR_WRITES_TTL)
+            except Exception as e:
+                logging.warning("Could not pin client to the primary after a write: %s", e)
+
+def build_session_factory(engine: AsyncEngine, class_: type[AsyncSession] = AsyncSession) -> sessionmaker:
+    return sessionmaker(
+        bind=engine,
+        class_=class_,
+        expire_on_commit=False
+    )
+
+async_engine = build_engine(Config.DATABASE_URL)
+
+# Built once and shared by every request
+async_session = build_session_factory(async_engine, PrimarySession)
+
+class ReplicaRouter:
+    '''Round-robin over read replicas, skipping ones that recently failed'''
+    def __init__(self, urls: list[str]) -> None:
+        self.engines = [build_engine(url) for url in urls]
+        self.session_factories = [build_session_factory(engine) for engine in self.engines]
+        self.down_until = [0.0] * len(self.engines)
+        self.turns = itertools.cycle(range(len(self.engines)))
+
+    def pick(self) -> int | None:
+        '''Index of the next healthy replica, or None to fall back to the primary'''
+        now = time.monotonic()
+        for _ in range(len(self.engines)):
+            index = next(self.turns)
+            if self.down_until[index] <= now:
+                return index
+
+        return None
+
+    def mark_down(self, index: int) -> None:
+        self.down_until[index] = time.monotonic() + Config.REPLICA_RETRY_AFTER
+
+replica_router = ReplicaRouter(Config.DATABASE_REPLICA_URLS)
+
+def get_client_key(request: Request) -> str:
+    '''Identify the client for read-your-writes: the token's user, else the peer address'''
+    token_data = getattr(request.state, "token_data", None)
+    if token_data:
+        return token_data["user"]["user_uid"]
+
+    return request.client.host if request.client else "anonymous"
+
+def read_your_writes_key(request: Request) -> str:
+    return f"ryw:{get_client_key(request)}"
+
+async def warm_pool(engine: AsyncEngine, connections: int) -> None:
+    '''Open connections up front and hand them back to the pool'''
+    # Held together, otherwise every checkout would reuse the first connection
+    opened = await asyncio.gather(
+        *(engine.connect() for _ in range(min(connections, Config.DB_POOL_SIZE))),
+        return_exceptions=True
+    )
+    for conn in opened:
+        if isinstance(conn, BaseException):
+            logging.warning("Could not warm a connection to %s: %s", engine.url.render_as_string(), conn)
+        else:
+            await conn.close()
+
+async def dispose_engines() -> None:
+    '''Close the primary's and every replica's pooled connections'''
+    await asyncio.gather(async_engine.dispose(), *(engine.dispose() for engine in replica_router.engines))
 
 async def init_db():
     async with async_engine.begin() as conn:
@@ -17,13 +143,43 @@ async def init_db():
 
         await conn.run_sync(SQLModel.metadata.create_all)
 
-async def get_session() -> AsyncSession:
-    Session = sessionmaker(
-        bind=async_engine,
-        class_=AsyncSession,
-        expire_on_commit=False
-    )
+async def get_session(request: Request) -> AsyncSession:
+    async with async_session() as session:
+        # Lets commits send this client's reads to the primary until replicas have caught up
+        session.info["request"] = request
+        yield session
 
-    async with Session() as session:
+async def get_read_session(request: Request) -> AsyncSession:
+    '''Session for read-only routes, served by a replica when one is healthy'''
+    index = None
+    if replica_router.engines and not await redis_client.exists(read_your_writes_key(request)):
+        index = replica_router.pick()
+
+    if index is not None:
+        async with replica_router.session_factories[index]() as session:
+            try:
+                # Connect up front so a dead replica falls back instead of failing the request
+                await session.connection()
+            except Exception as e:
+                logging.warning("Replica %s unavailable, using primary: %s", index, e)
+                replica_router.mark_down(index)
+            else:
+                yield session
+                return
+
+    async with async_session() as session:
         yield session
-        
\ No newline at end of file
+
+def get_pool_stats(engine: AsyncEngine = async_engine) -> dict:
+    '''Connection pool usage, to size Postgres connections per uvicorn worker'''
+    pool = engine.pool
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": max(pool.overflow(), 0),
+        "max_overflow": Config.DB_MAX_OVERFLOW,
+        "checkouts": pool.checkouts,
+        "avg_wait_ms": round(pool.total_wait / pool.checkouts * 1000, 3) if pool.checkouts else 0.0,
+        "max_wait_ms": round(pool.max_wait * 1000, 3),
+    }
@@ -0,0 +1,109 @@
+import logging
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from src.db.slow_query import normalize_sql
+from src.metrics import route_template
+
+logger = logging.getLogger(__name__)
+
+class QueryBudgetExceeded(AssertionError):
+    '''More SQL statements ran than the route or block declared'''
+
+class QueryLog:
+    '''SQL statements issued while it is current, passed on to the enclosing log too'''
+    def __init__(self, budget: int | None = None, parent: "QueryLog | None" = None) -> None:
+        self.budget = budget
+        self.parent = parent
+        self.statements: list[str] = []
+
+    def record(self, statement: str) -> None:
+        self.statements.append(statement)
+        if self.parent is not None:
+            self.parent.record(statement)
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def repeated(self, threshold: int) -> dict[str, int]:
+        '''Statement shapes that ran at least threshold times, the usual sign of an N+1'''
+        shapes = Counter(normalize_sql(statement) for statement in self.statements)
+        return {shape: times for shape, times in shapes.items() if times >= threshold}
+
+    def over_budget(self) -> bool:
+        return self.budget is not None and self.count > self.budget
+
+    def report(self, label: str) -> str:
+        statements = "\n".join(f"  {normalize_sql(statement)}" for statement in self.statements)
+        return f"{label} ran {self.count} SQL statements, budget is {self.budget}:\n{statements}"
+
+current_queries: ContextVar[QueryLog | None] = ContextVar("current_queries", default=None)
+
+# Registered on the Engine class, so the primary and every replica are covered
+@event.listens_for(Engine, "after_cursor_execute")
+def record_statement(conn, cursor, statement, parameters, context, executemany):
+    log = current_queries.get()
+    if log is not None:
+        log.record(statement)
+
+@contextmanager
+def count_queries(budget: int | None = None):
+    '''Collect the statements run inside the block, raising if there are more than budget
+
+    with count_queries(2) as queries:
+        await client.get("/api/v1/games/")
+    '''
+    log = QueryLog(budget, parent=current_queries.get())
+    token = current_queries.set(log)
+    try:
+        yield log
+    finally:
+        current_queries.reset(token)
+
+    if log.over_budget():
+        raise QueryBudgetExceeded(log.report("Block"))
+
+class QueryBudget():
+    '''Route dependency declaring how many SQL statements one request may run'''
+    def __init__(self, budget: int) -> None:
+        self.budget = budget
+
+    async def __call__(self) -> None:
+        log = current_queries.get()
+        if log is not None:
+            log.budget = self.budget
+
+class QueryBudgetMiddleware:
+    '''Count statements per request, check them against the route's QueryBudget and flag repeated shapes'''
+    def __init__(self, app: ASGIApp, mode: str = "warn", repeat_threshold: int = 0) -> None:
+        self.app = app
+        self.mode = mode
+        self.repeat_threshold = repeat_threshold
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        log = QueryLog(parent=current_queries.get())
+        token = current_queries.set(log)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_queries.reset(token)
+
+        label = f"{scope['method']} {route_template(scope)}"
+        if self.repeat_threshold:
+            for shape, times in log.repeated(self.repeat_threshold).items():
+                logger.warning("Possible N+1 in %s, ran %s times: %s", label, times, shape)
+
+        if log.over_budget():
+            # The response is already out, so "raise" is for test clients, not production
+            if self.mode == "raise":
+                raise QueryBudgetExceeded(log.report(label))
+            logger.warning(log.report(label))
@@ -1,19 +1,270 @@
+import json
+import time
+import asyncio
+import logging
+from typing import Callable
+from collections import defaultdict
 import redis.asyncio as redis
 
+from src.cache import TTLCache, BloomFilter
 from src.config import Config
+from src.metrics import timed
 
-# Initilize an async Redis client to revoke blocklisted tokens
-token_blocklist = redis.Redis(
+class InstrumentedRedis(redis.Redis):
+    '''Redis client that charges every round trip to the current request's metrics'''
+    async def execute_command(self, *args, **options):
+        with timed("redis"):
+            return await super().execute_command(*args, **options)
+
+    def pipeline(self, transaction: bool = True, shard_hint=None):
+        pipe = super().pipeline(transaction, shard_hint)
+        execute = pipe.execute
+
+        # A pipeline is one round trip however many commands it queued
+        async def timed_execute(*args, **kwargs):
+            with timed("redis"):
+                return await execute(*args, **kwargs)
+
+        pipe.execute = timed_execute
+        return pipe
+
+# Initilize an async Redis client shared by the blocklist, caches and pub/sub
+redis_client = InstrumentedRedis(
     host=Config.REDIS_HOST,
     port=Config.REDIS_PORT,
     db=0
 )
 
+# Pub/sub channel -> handlers run by this worker for every message on it
+channel_handlers: dict[str, list[Callable[[dict], None]]] = defaultdict(list)
+# Run after every (re)subscribe: messages published while unsubscribed are lost
+resubscribe_hooks: list[Callable[[], None]] = []
+pubsub_task: asyncio.Task | None = None
+
+def subscribe(channel: str, handler: Callable[[dict], None]) -> None:
+    '''Register a handler for JSON messages on a channel (call at import time)'''
+    channel_handlers[channel].append(handler)
+
+def on_resubscribe(hook: Callable[[], None]) -> None:
+    '''Register a hook that resyncs local state missed while unsubscribed (call at import time)'''
+    resubscribe_hooks.append(hook)
+
+async def publish(channel: str, message: dict) -> None:
+    '''Broadcast a JSON message to every worker subscribed to the channel'''
+    await redis_client.publish(channel, json.dumps(message))
+
+def start_pubsub_listener() -> None:
+    '''Start this worker's pub/sub listener unless it is already running'''
+    global pubsub_task
+    if pubsub_task is None or pubsub_task.done():
+        pubsub_task = asyncio.get_running_loop().create_task(listen_to_channels())
+
+async def stop_pubsub_listener() -> None:
+    '''Cancel this worker's pub/sub listener, if it is running'''
+    global pubsub_task
+    if pubsub_task is not None:
+        pubsub_task.cancel()
+        await asyncio.gather(pubsub_task, return_exceptions=True)
+        pubsub_task = None
+
+async def listen_to_channels() -> None:
+    '''Dispatch pub/sub messages to local handlers, reconnecting on errors'''
+    while True:
+        pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(*channel_handlers)
+            for hook in resubscribe_hooks:
+                hook()
+            async for message in pubsub.listen():
+                channel = message["channel"].decode()
+                payload = json.loads(message["data"])
+                for handler in channel_handlers.get(channel, []):
+                    try:
+                        handler(payload)
+                    except Exception as e:
+                        logging.exception(e)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.exception(e)
+            await asyncio.sleep(1)
+        finally:
+            await pubsub.aclose()
+
+BLOCKLIST_INDEX_KEY = "blocklist:jtis"
+BLOCKLIST_CHANNEL = "blocklist:revoked"
+
+class RevokedTokenFilter:
+    '''Local Bloom filter of revoked JTIs so Redis is only asked on a possible hit'''
+    def __init__(self) -> None:
+        self.bloom = BloomFilter(Config.BLOCKLIST_FILTER_CAPACITY, Config.BLOCKLIST_FILTER_ERROR_RATE)
+        self.next_rebuild = 0.0
+        self.rebuilding: list[str] | None = None
+        self.lock = asyncio.Lock()
+        # Bumped when revocations may have been missed, so a rebuild already under way doesn't count
+        self.epoch = 0
+
+    def invalidate(self) -> None:
+        '''Rebuild from the Redis index on next use, e.g. after broadcasts were missed'''
+        self.epoch += 1
+        self.next_rebuild = 0.0
+
+    def add(self, message: dict) -> None:
+        '''Record a revocation broadcast by any worker'''
+        self.bloom.add(message["jti"])
+        if self.rebuilding is not None:
+            self.rebuilding.append(message["jti"])
+
+    async def ensure_fresh(self) -> None:
+        '''Rebuild from the Redis index on first use and then periodically, dropping expired JTIs'''
+        if time.monotonic() < self.next_rebuild:
+            return
+
+        async with self.lock:
+            if time.monotonic() < self.next_rebuild:
+                return
+
+            start_pubsub_listener()
+            self.rebuilding = []
+            epoch = self.epoch
+            try:
+                now = time.time()
+                await redis_client.zremrangebyscore(BLOCKLIST_INDEX_KEY, "-inf", now)
+                jtis = await redis_client.zrange(BLOCKLIST_INDEX_KEY, 0, -1)
+
+                bloom = BloomFilter(Config.BLOCKLIST_FILTER_CAPACITY, Config.BLOCKLIST_FILTER_ERROR_RATE)
+                for jti in jtis:
+                    bloom.add(jti.decode())
+
+                # Keep revocations that arrived over pub/sub while we were loading
+                for jti in self.rebuilding:
+                    bloom.add(jti)
+
+                self.bloom = bloom
+                if epoch == self.epoch:
+                    self.next_rebuild = time.monotonic() + Config.BLOCKLIST_FILTER_REBUILD_INTERVAL
+            finally:
+                self.rebuilding = None
+
+    def might_contain(self, jti: str) -> bool:
+        return jti in self.bloom
+
+revoked_tokens = RevokedTokenFilter()
+subscribe(BLOCKLIST_CHANNEL, revoked_tokens.add)
+on_resubscribe(revoked_tokens.invalidate)
+
 async def add_jti_to_blocklist(jti: str) -> None:
-    '''Add JWT token to blocklist'''
-    await token_blocklist.set(jti, "", ex=Config.JTI_EXPIRY)
+    '''Add JWT token to blocklist and tell every worker's local filter about it'''
+    expires_at = time.time() + Config.JTI_EXPIRY
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.set(jti, "", ex=Config.JTI_EXPIRY)
+        pipe.zadd(BLOCKLIST_INDEX_KEY, {jti: expires_at})
+        pipe.publish(BLOCKLIST_CHANNEL, json.dumps({"jti": jti}))
+        await pipe.execute()
+
+    revoked_tokens.bloom.add(jti)
 
 async def token_in_blocklist(jti: str) -> bool:
-    '''Check if JWT token is blocklisted'''
-    jti_found = await token_blocklist.get(jti)
+    '''Check if JWT token is blocklisted, skipping Redis when the local filter rules it out'''
+    await revoked_tokens.ensure_fresh()
+    if not revoked_tokens.might_contain(jti):
+        return False
+
+    jti_found = await redis_client.get(jti)
     return jti_found is not None
+
+TOKEN_GENERATION_CHANNEL = "token-generation:bumped"
+
+class TokenGenerations:
+    '''Per-user token generation counters, cached locally and kept in sync over pub/sub'''
+    def __init__(self) -> None:
+        self.local = TTLCache(maxsize=Config.USER_CACHE_SIZE, ttl=Config.TOKEN_GENERATION_CACHE_TTL)
+
+    @staticmethod
+    def key(user_uid: str) -> str:
+        return f"token_gen:{user_uid}"
+
+    def update_local(self, message: dict) -> None:
+        '''Record a bump broadcast by any worker'''
+        self.remember(message["user_uid"], message["generation"])
+
+    def remember(self, user_uid: str, generation: int) -> int:
+        '''Cache a generation unless a newer one is already cached; generations only go up'''
+        generation = max(generation, self.local.get(user_uid, 0))
+        self.local.set(user_uid, generation)
+        return generation
+
+    async def get(self, user_uid: str) -> int:
+        '''Current generation; tokens minted with an older one are revoked'''
+        start_pubsub_listener()
+        generation = self.local.get(user_uid)
+        if generation is None:
+            generation = int(await redis_client.get(self.key(user_uid)) or 0)
+            # A bump may have arrived over pub/sub while we were reading
+            generation = self.remember(user_uid, generation)
+
+        return generation
+
+    async def bump(self, user_uid: str) -> int:
+        '''Revoke every outstanding access and refresh token of a user at once'''
+        # No expiry: tokens minted after the bump carry its generation, and if the counter
+        # expired the next bump would count up from 0 again and revoke none of them
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.incr(self.key(user_uid))
+            # Counters written before this fix still carry a TTL
+            pipe.persist(self.key(user_uid))
+            generation, _ = await pipe.execute()
+
+        message = {"user_uid": user_uid, "generation": generation}
+        self.update_local(message)
+        await publish(TOKEN_GENERATION_CHANNEL, message)
+        return generation
+
+token_generations = TokenGenerations()
+subscribe(TOKEN_GENERATION_CHANNEL, token_generations.update_local)
+# Bumps missed while unsubscribed: read the counters from Redis again
+on_resubscribe(token_generations.local.clear)
+
+async def reserve_verification_email(email: str, token: str) -> str | None:
+    '''Claim the verification send for an email; returns the pending token if one already went out'''
+    # SET NX GET: a single round trip that either claims the window or reads the holder
+    pending = await redis_client.set(
+        f"verify_email:{email}", token, nx=True, get=True, ex=Config.VERIFY_EMAIL_DEBOUNCE
+    )
+    return pending.decode() if pending is not None else None
+
+# Token bucket over every key at once: either all buckets pay one token or none do
+RATE_LIMIT_SCRIPT = redis_client.register_script("""
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local ttl = math.ceil(capacity / rate) + 1
+local tokens = {}
+local wait = 0
+
+for i, key in ipairs(KEYS) do
+    local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+    local available = tonumber(bucket[1]) or capacity
+    local last = tonumber(bucket[2]) or now
+    available = math.min(capacity, available + math.max(0, now - last) * rate)
+    tokens[i] = available
+    if available < 1 then
+        wait = math.max(wait, (1 - available) / rate)
+    end
+end
+
+if wait > 0 then
+    return {0, tostring(wait)}
+end
+
+for i, key in ipairs(KEYS) do
+    redis.call('HSET', key, 'tokens', tostring(tokens[i] - 1), 'ts', tostring(now))
+    redis.call('EXPIRE', key, ttl)
+end
+return {1, '0'}
+""")
+
+async def consume_rate_limit(keys: list[str], capacity: int, refill_per_second: float) -> tuple[bool, float]:
+    '''Take one token from each bucket in one round trip; returns (allowed, seconds to wait)'''
+    allowed, wait = await RATE_LIMIT_SCRIPT(keys=keys, args=[capacity, refill_per_second, time.time()])
+    return bool(allowed), float(wait)
@@ -0,0 +1,124 @@
+import re
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import contextvars
+from collections import deque
+from datetime import datetime
+from greenlet import getcurrent
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from src.config import Config
+
+logger = logging.getLogger(__name__)
+
+WHITESPACE = re.compile(r"\s+")
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r"(?<![\w$])\d+(?:\.\d+)?\b")
+IN_LIST = re.compile(r"\bIN \([^()]*\)", re.IGNORECASE)
+VALUES_ROWS = re.compile(r"(\bVALUES \([^()]*\))(?:, \([^()]*\))+", re.IGNORECASE)
+
+def normalize_sql(statement: str) -> str:
+    '''One-line SQL with literals, IN lists and multi-row VALUES folded, so repeats of a query look the same'''
+    statement = WHITESPACE.sub(" ", statement).strip()
+    statement = STRING_LITERAL.sub("?", statement)
+    statement = NUMBER_LITERAL.sub("?", statement)
+    statement = VALUES_ROWS.sub(r"\1, ...", statement)
+    return IN_LIST.sub("IN (...)", statement)
+
+def parameters_shape(parameters, executemany: bool) -> object:
+    '''Types of the bound parameters, never their values'''
+    # executemany passes one parameter set per row (a multi-row VALUES passes one flat set)
+    if executemany and parameters and isinstance(parameters[0], (dict, list, tuple)):
+        return {"rows": len(parameters), "row": parameters_shape(parameters[0], False)}
+    if isinstance(parameters, dict):
+        return {name: type(value).__name__ for name, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [type(value).__name__ for value in parameters]
+
+    return None
+
+def find_caller() -> str | None:
+    '''Service method that issued the statement, e.g. GameService.get_all_games'''
+    frame = sys._getframe(1)
+    # Async statements run in a greenlet, the awaiting coroutines live on its parent's stack
+    parent = getcurrent().parent
+    fallback = None
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if module.startswith("src.") and module.endswith(".service"):
+            return frame.f_code.co_qualname
+        if fallback is None and module.startswith("src.") and not module.startswith(("src.db.", "src.metrics")):
+            fallback = f"{module}.{frame.f_code.co_qualname}"
+
+        frame = frame.f_back
+        if frame is None and parent is not None:
+            frame, parent = parent.gr_frame, parent.parent
+
+    return fallback
+
+class SlowQueryLog:
+    '''Ring buffer of recent slow statements, some with their EXPLAIN (ANALYZE, BUFFERS) plan'''
+    def __init__(self, size: int) -> None:
+        self.entries: deque[dict] = deque(maxlen=size)
+        self.explains: set[asyncio.Task] = set()
+
+    def record(self, conn, statement: str, parameters, executemany: bool, duration: float) -> None:
+        entry = {
+            "at": datetime.now().isoformat(),
+            "duration_ms": round(duration * 1000, 3),
+            "sql": normalize_sql(statement),
+            "parameters": parameters_shape(parameters, executemany),
+            "caller": find_caller(),
+        }
+        logger.warning("Slow query %s", json.dumps(entry))
+        self.entries.append(entry)
+
+        # ANALYZE runs the statement again, so only plain reads, and only a sample of them
+        if (
+            conn.dialect.name == "postgresql"
+            and not executemany
+            and entry["sql"].upper().startswith("SELECT")
+            and random.random() < Config.SLOW_QUERY_EXPLAIN_SAMPLE_RATE
+        ):
+            # Own connection and an empty context: never inside the request's transaction or metrics
+            task = asyncio.get_running_loop().create_task(
+                self.explain(AsyncEngine(conn.engine), statement, parameters, entry),
+                context=contextvars.Context()
+            )
+            self.explains.add(task)
+            task.add_done_callback(self.explains.discard)
+
+    async def explain(self, engine: AsyncEngine, statement: str, parameters, entry: dict) -> None:
+        try:
+            async with engine.connect() as conn:
+                result = await conn.exec_driver_sql(
+                    f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {statement}", parameters
+                )
+                plan = result.scalar()
+                entry["plan"] = json.loads(plan) if isinstance(plan, str) else plan
+                await conn.rollback()
+        except Exception as e:
+            entry["plan_error"] = str(e)
+
+    def recent(self) -> list[dict]:
+        '''Newest first'''
+        return list(reversed(self.entries))
+
+slow_query_log = SlowQueryLog(Config.SLOW_QUERY_LOG_SIZE)
+
+# Registered on the Engine class, so the primary and every replica are covered
+@event.listens_for(Engine, "before_cursor_execute")
+def start_slow_query_timer(conn, cursor, statement, parameters, context, executemany):
+    context.slow_query_start = time.perf_counter()
+
+@event.listens_for(Engine, "after_cursor_execute")
+def log_slow_query(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - context.slow_query_start
+    if duration * 1000 >= Config.SLOW_QUERY_MS and not statement.startswith("EXPLAIN"):
+        slow_query_log.record(conn, statement, parameters, executemany, duration)
@@ -0,0 +1,55 @@
+import time
+import asyncio
+from typing import Awaitable, Callable
+from datetime import datetime, timezone
+
+from src.config import Config
+from src.db.redis import redis_client
+
+GAMES_VERSION_KEY = "games:version"
+
+async def get_games_version() -> tuple[int, datetime]:
+    """Table-level version and last-modified time of the games table"""
+    version, modified = await redis_client.hmget(GAMES_VERSION_KEY, "version", "modified")
+
+    # Fresh or flushed Redis: start a new timeline so ETags handed out earlier can't match
+    if modified is None:
+        await redis_client.hsetnx(GAMES_VERSION_KEY, "modified", time.time())
+        version, modified = await redis_client.hmget(GAMES_VERSION_KEY, "version", "modified")
+
+    return int(version or 0), datetime.fromtimestamp(float(modified), tz=timezone.utc)
+
+def bump_games_version(pipe) -> None:
+    """Queue a version bump on a Redis pipeline, alongside the write's other side effects"""
+    pipe.hincrby(GAMES_VERSION_KEY, "version", 1)
+    pipe.hset(GAMES_VERSION_KEY, "modified", time.time())
+
+def listing_cache_key(version: int, query_digest: str) -> str:
+    """Cache key of a serialized listing; bumping the version orphans every older key"""
+    return f"games:list:{version}:{query_digest}"
+
+async def get_or_compute_listing(key: str, compute: Callable[[], Awaitable[bytes]]) -> bytes:
+    """Serve pre-serialized JSON from Redis, letting only one worker recompute a cold key"""
+    cached = await redis_client.get(key)
+    if cached is not None:
+        return cached
+
+    lock_key = f"{key}:lock"
+    lock_timeout = Config.GAMES_LIST_CACHE_LOCK_TIMEOUT
+    deadline = time.monotonic() + lock_timeout
+    locked = await redis_client.set(lock_key, 1, nx=True, px=int(lock_timeout * 1000))
+
+    # Someone else is recomputing: wait for their result, unless they take too long
+    while not locked and time.monotonic() < deadline:
+        await asyncio.sleep(0.025)
+        cached = await redis_client.get(key)
+        if cached is not None:
+            return cached
+
+    try:
+        body = await compute()
+        await redis_client.set(key, body, ex=Config.GAMES_LIST_CACHE_TTL)
+        return body
+    finally:
+        if locked:
+            await redis_client.delete(lock_key)
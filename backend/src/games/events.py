@@ -0,0 +1,65 @@
+import json
+import asyncio
+import logging
+
+from src.config import Config
+from src.db.redis import redis_client, subscribe
+
+from .models import Game
+from .cache import bump_games_version
+
+GAME_EVENTS_CHANNEL = "games:events"
+
+async def publish_game_event(event_type: str, game: Game) -> None:
+    """Bump the games table version and broadcast a compact change event, in one round trip"""
+    await publish_game_events(event_type, [game])
+
+async def publish_game_events(event_type: str, games: list[Game]) -> None:
+    """Bump the version once for a batch of changed games and broadcast one event per game"""
+    # Runs after the commit: a Redis failure must not turn a write that went through into a 500
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            bump_games_version(pipe)
+            for game in games:
+                message = {"type": event_type, "uid": str(game.uid)}
+                if event_type != "game.deleted":
+                    message["game"] = game.model_dump(mode="json")
+                pipe.publish(GAME_EVENTS_CHANNEL, json.dumps(message))
+            await pipe.execute()
+    except Exception as e:
+        # Cached listings still expire after GAMES_LIST_CACHE_TTL
+        logging.warning("Could not publish %s for %s games: %s", event_type, len(games), e)
+
+class GameEventConnection:
+    """Bounded outgoing queue for one socket; overflowing marks it as a slow consumer"""
+    def __init__(self) -> None:
+        self.queue: asyncio.Queue[str] = asyncio.Queue(maxsize=Config.GAMES_WS_QUEUE_SIZE)
+        self.overflowed = asyncio.Event()
+
+    def push(self, payload: str) -> None:
+        try:
+            self.queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            self.overflowed.set()
+
+class GameEventHub:
+    """Fans events received over Redis pub/sub out to this worker's sockets"""
+    def __init__(self) -> None:
+        self.connections: set[GameEventConnection] = set()
+
+    def connect(self) -> GameEventConnection:
+        connection = GameEventConnection()
+        self.connections.add(connection)
+        return connection
+
+    def disconnect(self, connection: GameEventConnection) -> None:
+        self.connections.discard(connection)
+
+    def broadcast(self, message: dict) -> None:
+        # Serialize once, not once per socket
+        payload = json.dumps(message)
+        for connection in self.connections:
+            connection.push(payload)
+
+game_event_hub = GameEventHub()
+subscribe(GAME_EVENTS_CHANNEL, game_event_hub.broadcast)
@@ -1,10 +1,15 @@
 import uuid
+from typing import Optional
 from datetime import datetime
 import sqlalchemy.dialects.postgresql as pg
-from sqlmodel import SQLModel, Field, Column
+from sqlmodel import SQLModel, Field, Column, Index
 
 class Game(SQLModel, table=True):
     __tablename__ = "games"
+    __table_args__ = (
+        # Serves the newest-first keyset pagination of the game feed
+        Index("ix_games_created_at_uid", "created_at", "uid"),
+    )
 
     uid: uuid.UUID=Field(
         sa_column=Column(
@@ -15,12 +20,17 @@ class Game(SQLModel, table=True):
         )
     )
     title: str
-    game_time: datetime = Field(sa_column=Column(pg.TIMESTAMP))
+    game_time: datetime = Field(sa_column=Column(pg.TIMESTAMP, index=True))
     location: str
     buy_in: int
     host: str
+    # Optional venue coordinates for "near me" search, indexed with ll_to_earth (migration d41b7e8c2f05)
+    latitude: Optional[float] = Field(default=None, sa_column=Column(pg.DOUBLE_PRECISION, nullable=True))
+    longitude: Optional[float] = Field(default=None, sa_column=Column(pg.DOUBLE_PRECISION, nullable=True))
     created_at: datetime = Field(sa_column=Column(pg.TIMESTAMP, default=datetime.now))
     updated_at: datetime = Field(sa_column=Column(pg.TIMESTAMP, default=datetime.now))
+    # Bumped by every write, checked against If-Match to reject lost updates
+    version: int = Field(default=1, sa_column=Column(pg.INTEGER, nullable=False, default=1, server_default="1"))
 
     def __repr__(self):
         return f"<Game {self.title}>"
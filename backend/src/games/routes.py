@@ -1,45 +1,249 @@
-from typing import List
+import time
+import uuid
+import asyncio
+from typing import Any, List, Optional
 from fastapi.exceptions import HTTPException
-from fastapi import status, APIRouter, Depends
+from fastapi import status, APIRouter, Depends, Request, Response, WebSocket, WebSocketDisconnect
 from sqlmodel.ext.asyncio.session import AsyncSession
 
-from src.db.main import get_session
+from src.config import Config
+from src.db.main import get_session, get_read_session
+from src.db.query_budget import QueryBudget
+from src.responses import ModelJSON, NegotiatedRoute, SparseFields
+from src.db.redis import start_pubsub_listener
 from src.auth.dependencies import RoleChecker, AccessTokenBearer
 
 from .models import Game
 from .service import GameService
-from .schemas import GameCreateModel, GameUpdateModel
+from .events import game_event_hub
+from .cache import get_games_version, listing_cache_key, get_or_compute_listing
+from .utils import game_etag, game_list_etag, query_digest, http_date, is_not_modified, if_match_versions
+from .schemas import (
+    GameCreateModel, GameUpdateModel, GameFilterModel, GamePageModel, GameSparsePageModel,
+    GameBulkCreateModel, GameBulkUpdateModel, GameBulkDeleteModel, GameBulkResultModel,
+    GameSearchModel, GameSearchResultsModel
+)
 
-game_router = APIRouter()
+game_router = APIRouter(route_class=NegotiatedRoute)
 game_service = GameService()
-access_token_bearer = Depends(AccessTokenBearer())
+access_token_verifier = AccessTokenBearer()
+access_token_bearer = Depends(access_token_verifier)
 role_checker = Depends(RoleChecker(["admin", "staff", "basic_user", "premium_user"]))
+# SQL statements per request, counting the user lookup on an identity cache miss
+read_budget = Depends(QueryBudget(2))
+write_budget = Depends(QueryBudget(3))
+game_json = ModelJSON(Game)
+game_page_json = ModelJSON(GamePageModel)
+bulk_result_json = ModelJSON(GameBulkResultModel)
+search_results_json = ModelJSON(GameSearchResultsModel)
+sparse_game_json = ModelJSON(dict[str, Any], matches_response_model=False)
+sparse_page_json = ModelJSON(GameSparsePageModel, matches_response_model=False)
+game_fields = SparseFields(Game)
 
 @game_router.get(
     "/", 
-    response_model=List[Game], 
-    dependencies=[access_token_bearer, role_checker]
+    response_model=GamePageModel, 
+    dependencies=[access_token_bearer, role_checker, read_budget]
 )
 async def get_all_games(
+    request: Request,
+    filters: GameFilterModel = Depends(),
+    fields: Optional[List[str]] = Depends(game_fields),
     session: AsyncSession = Depends(get_session)
 ):
-    """Return all games in our DB"""
-    games = await game_service.get_all_games(session)
-    return games
+    """Return a page of games matching the filters, newest first"""
+    # Read the version before the rows, so a concurrent write can only make Last-Modified stale, never wrong
+    version, modified = await get_games_version()
+
+    async def render_page() -> bytes:
+        try:
+            page = await game_service.get_all_games(filters, session, fields)
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid pagination cursor"
+            )
+
+        return game_page_json.dumps(page) if fields is None else sparse_page_json.dumps(page)
+
+    # Pre-serialized page from Redis, or rendered once and shared with other workers. It is
+    # rendered from the primary: a lagging replica could store pre-write rows under the new version
+    body = await get_or_compute_listing(listing_cache_key(version, query_digest(request)), render_page)
+    headers = {
+        "ETag": game_list_etag(body),
+        "Last-Modified": http_date(modified),
+        "Cache-Control": "private, no-cache",
+    }
+
+    # Client already has this exact page
+    if is_not_modified(request, headers["ETag"], modified):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# Declared before /{game_uid} so "search" isn't taken for a uid
+@game_router.get(
+    "/search",
+    response_model=GameSearchResultsModel,
+    dependencies=[access_token_bearer, role_checker, read_budget]
+)
+async def search_games(
+    search: GameSearchModel = Depends(),
+    session: AsyncSession = Depends(get_read_session)
+):
+    """Find games by title/location text and distance, best matches first"""
+    if (search.lat is None) != (search.lng is None):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="lat and lng must be sent together"
+        )
+
+    results = await game_service.search_games(search, session)
+    return search_results_json.render(results)
+
+@game_router.websocket("/ws")
+async def stream_game_events(websocket: WebSocket):
+    """Push game create/update/delete events to the client instead of re-polling"""
+    # Browsers can't set headers on a WebSocket handshake, so also accept ?token=
+    token = websocket.query_params.get("token")
+    auth_header = websocket.headers.get("authorization", "")
+    if not token and auth_header.lower().startswith("bearer "):
+        token = auth_header[7:]
+
+    try:
+        if not token:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+        token_data = await access_token_verifier.validate_token(token)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.accept()
+    start_pubsub_listener()
+    connection = game_event_hub.connect()
+
+    async def send_events():
+        while True:
+            await websocket.send_text(await connection.queue.get())
+
+    async def wait_for_disconnect():
+        while True:
+            await websocket.receive_text()
+
+    async def wait_for_token_invalid():
+        # Re-validate periodically and at expiry, catching logouts and password resets too
+        while True:
+            await asyncio.sleep(min(Config.GAMES_WS_TOKEN_RECHECK_INTERVAL, max(token_data["exp"] - time.time() + 1, 0)))
+            try:
+                await access_token_verifier.validate_token(token)
+            except HTTPException:
+                return
+
+    token_invalid = asyncio.create_task(wait_for_token_invalid())
+    tasks = [
+        asyncio.create_task(send_events()),
+        asyncio.create_task(wait_for_disconnect()),
+        asyncio.create_task(connection.overflowed.wait()),
+        token_invalid,
+    ]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        game_event_hub.disconnect(connection)
+        for task in tasks:
+            task.cancel()
+            # Consume a disconnect error so it isn't reported as unretrieved
+            if task.done() and not task.cancelled():
+                task.exception()
+
+    # Expired or revoked token: the client has to reconnect with a fresh one
+    if token_invalid.done() and not token_invalid.cancelled():
+        try:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        except (RuntimeError, WebSocketDisconnect):
+            pass
+
+    # Slow consumer: drop it rather than buffer without bound, the client re-syncs via GET /games
+    elif connection.overflowed.is_set():
+        try:
+            await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+        except (RuntimeError, WebSocketDisconnect):
+            pass
+
+# Declared before the /{game_uid} routes so "bulk" isn't taken for a uid
+@game_router.post(
+    "/bulk",
+    response_model=GameBulkResultModel,
+    dependencies=[access_token_bearer, role_checker, write_budget]
+)
+async def bulk_create_games(
+    bulk_data: GameBulkCreateModel,
+    session: AsyncSession = Depends(get_session)
+):
+    """Host many games in one transaction, reporting the items that were skipped"""
+    result = await game_service.bulk_create_games(bulk_data.games, session)
+    return bulk_result_json.render(result)
+
+@game_router.patch(
+    "/bulk",
+    response_model=GameBulkResultModel,
+    dependencies=[access_token_bearer, role_checker, write_budget]
+)
+async def bulk_update_games(
+    bulk_data: GameBulkUpdateModel,
+    session: AsyncSession = Depends(get_session)
+):
+    """Update many games in one transaction, reporting the items that were skipped"""
+    result = await game_service.bulk_update_games(bulk_data.games, session)
+    return bulk_result_json.render(result)
+
+@game_router.delete(
+    "/bulk",
+    response_model=GameBulkResultModel,
+    dependencies=[access_token_bearer, role_checker, write_budget]
+)
+async def bulk_delete_games(
+    bulk_data: GameBulkDeleteModel,
+    session: AsyncSession = Depends(get_session)
+):
+    """Delete many games in one transaction, reporting the uids that weren't found"""
+    result = await game_service.bulk_delete_games(bulk_data.uids, session)
+    return bulk_result_json.render(result)
 
 @game_router.get(
     "/{game_uid}",
     response_model=Game,
-    dependencies=[access_token_bearer, role_checker]
+    dependencies=[access_token_bearer, role_checker, read_budget]
 )
 async def get_game(
-    game_uid: str,
-    session: AsyncSession = Depends(get_session)
+    game_uid: uuid.UUID,
+    request: Request,
+    response: Response,
+    fields: Optional[List[str]] = Depends(game_fields),
+    session: AsyncSession = Depends(get_read_session)
 ):
-    """Get a game based on its uid"""
-    game = await game_service.get_game(game_uid, session)
+    """Get a game based on its uid, optionally only some of its fields"""
+    if fields is None:
+        game = await game_service.get_game(game_uid, session)
+    else:
+        game = await game_service.get_game_fields(game_uid, fields, session)
+
     if game:
-        return game
+        headers = {
+            "ETag": game_etag(game),
+            "Last-Modified": http_date(game.updated_at),
+            "Cache-Control": "private, no-cache",
+        }
+
+        # Client's copy is current, skip serializing the game
+        if is_not_modified(request, headers["ETag"], game.updated_at):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        response.headers.update(headers)
+        if fields is None:
+            return game_json.render(game, response)
+
+        return sparse_game_json.render({name: getattr(game, name) for name in fields}, response)
     else:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -50,7 +254,7 @@ async def get_game(
     "/",
     status_code=status.HTTP_201_CREATED,
     response_model=Game,
-    dependencies=[access_token_bearer, role_checker]
+    dependencies=[access_token_bearer, role_checker, write_budget]
 )
 async def create_game(
     game_data: GameCreateModel,
@@ -58,45 +262,58 @@ async def create_game(
 ) -> dict:
     """Host game with title and host information"""
     new_game = await game_service.create_game(game_data, session)
-    return new_game
+    return game_json.render(new_game, status_code=status.HTTP_201_CREATED)
 
 @game_router.patch(
     "/{game_uid}",
     response_model=Game,
-    dependencies=[access_token_bearer, role_checker]
+    dependencies=[access_token_bearer, role_checker, write_budget]
 )
 async def update_game(
-    game_uid: str,
+    game_uid: uuid.UUID,
     game_update_data: GameUpdateModel,
+    request: Request,
+    response: Response,
     session: AsyncSession = Depends(get_session)
 ):
-    """Update game based on its id with new information"""
-    game_to_update = await game_service.update_game(game_uid, game_update_data, session)
+    """Update game based on its id with new information, honoring If-Match"""
+    versions = if_match_versions(request, game_uid)
+    game_to_update = await game_service.update_game(game_uid, game_update_data, session, versions)
     
     if game_to_update:
-        return game_to_update
+        response.headers["ETag"] = game_etag(game_to_update)
+        return game_json.render(game_to_update, response)
     else:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Game not found"
-        )
+        await raise_write_failed(game_uid, versions, session)
 
 @game_router.delete(
     "/{game_uid}",
     status_code=status.HTTP_204_NO_CONTENT,
-    dependencies=[access_token_bearer, role_checker]
+    dependencies=[access_token_bearer, role_checker, write_budget]
 )
 async def delete_game(
-    game_uid: str,
+    game_uid: uuid.UUID,
+    request: Request,
     session: AsyncSession = Depends(get_session)
 ):
-    """Delete a game based on its id"""
-    game_to_delete = await game_service.delete_game(game_uid, session)
+    """Delete a game based on its id, honoring If-Match"""
+    versions = if_match_versions(request, game_uid)
+    game_to_delete = await game_service.delete_game(game_uid, session, versions)
     
     if game_to_delete:
         return {}
     else:
+        await raise_write_failed(game_uid, versions, session)
+
+async def raise_write_failed(game_uid: uuid.UUID, versions: list[int] | None, session: AsyncSession):
+    """A conditional write that matched no row hit either a missing game or a stale version"""
+    if versions is not None and await game_service.game_exists(game_uid, session):
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Game not found"
+            status_code=status.HTTP_412_PRECONDITION_FAILED,
+            detail="Game was modified, fetch it again and retry"
         )
+
+    raise HTTPException(
+        status_code=status.HTTP_404_NOT_FOUND,
+        detail="Game not found"
+    )
@@ -1,4 +1,11 @@
-from pydantic import BaseModel
+import uuid
+from typing import Any, List, Optional
+from datetime import datetime, timezone
+from pydantic import BaseModel, Field, field_validator
+
+from src.config import Config
+
+from .models import Game
 
 class GameCreateModel(BaseModel):
     title: str
@@ -6,9 +13,95 @@ class GameCreateModel(BaseModel):
     location: str
     buy_in: int
     host: str
+    latitude: Optional[float] = Field(default=None, ge=-90, le=90)
+    longitude: Optional[float] = Field(default=None, ge=-180, le=180)
     
 class GameUpdateModel(BaseModel):
     title: str
     game_time: str
     location: str
     buy_in: int
+    # Left as they are unless sent
+    latitude: Optional[float] = Field(default=None, ge=-90, le=90)
+    longitude: Optional[float] = Field(default=None, ge=-180, le=180)
+
+def naive_utc(moment: Optional[datetime]) -> Optional[datetime]:
+    '''game_time is stored without a zone, so an aware bound is compared as UTC'''
+    if moment is None or moment.tzinfo is None:
+        return moment
+    return moment.astimezone(timezone.utc).replace(tzinfo=None)
+
+class GameFilterModel(BaseModel):
+    '''Query params to page through and narrow down the game feed'''
+    cursor: Optional[str] = None
+    limit: Optional[int] = Field(default=None, ge=1)
+    game_time_from: Optional[datetime] = None
+    game_time_to: Optional[datetime] = None
+    buy_in_min: Optional[int] = Field(default=None, ge=0)
+    buy_in_max: Optional[int] = Field(default=None, ge=0)
+    location: Optional[str] = None
+    host: Optional[str] = None
+
+    # asyncpg refuses an aware datetime for a TIMESTAMP WITHOUT TIME ZONE column
+    _naive_game_time = field_validator("game_time_from", "game_time_to")(naive_utc)
+
+class GamePageModel(BaseModel):
+    '''One page of games plus the cursor to fetch the next page'''
+    games: List[Game]
+    next_cursor: Optional[str] = None
+
+class GameSparsePageModel(BaseModel):
+    '''One page of games trimmed to the fields asked for with ?fields='''
+    games: List[dict[str, Any]]
+    next_cursor: Optional[str] = None
+
+class GameBulkCreateModel(BaseModel):
+    '''Games to host in one request'''
+    games: List[GameCreateModel] = Field(min_length=1, max_length=Config.GAMES_BULK_MAX)
+
+class GameBulkUpdateItem(GameUpdateModel):
+    uid: uuid.UUID
+    # Same role as If-Match on a single PATCH: skip the item unless the game is still at this version
+    version: Optional[int] = None
+
+class GameBulkUpdateModel(BaseModel):
+    '''Games to update in one request, each identified by its uid'''
+    games: List[GameBulkUpdateItem] = Field(min_length=1, max_length=Config.GAMES_BULK_MAX)
+
+class GameBulkDeleteModel(BaseModel):
+    '''Uids of the games to delete in one request'''
+    uids: List[uuid.UUID] = Field(min_length=1, max_length=Config.GAMES_BULK_MAX)
+
+class GameBulkErrorModel(BaseModel):
+    '''Why one item of a bulk request was skipped, by its position in the request'''
+    index: int
+    uid: Optional[uuid.UUID] = None
+    detail: str
+
+class GameBulkResultModel(BaseModel):
+    '''Games a bulk request applied to plus the items it skipped'''
+    games: List[Game] = []
+    errors: List[GameBulkErrorModel] = []
+
+class GameSearchModel(BaseModel):
+    '''Query params for ranked search by text, distance, time window and buy-in'''
+    q: Optional[str] = Field(default=None, min_length=1, max_length=200)
+    lat: Optional[float] = Field(default=None, ge=-90, le=90)
+    lng: Optional[float] = Field(default=None, ge=-180, le=180)
+    radius_km: float = Field(default=Config.GAMES_SEARCH_RADIUS_KM, gt=0, le=Config.GAMES_SEARCH_RADIUS_KM_MAX)
+    game_time_from: Optional[datetime] = None
+    game_time_to: Optional[datetime] = None
+    buy_in_max: Optional[int] = Field(default=None, ge=0)
+    limit: Optional[int] = Field(default=None, ge=1)
+
+    _naive_game_time = field_validator("game_time_from", "game_time_to")(naive_utc)
+
+class GameSearchHitModel(BaseModel):
+    '''A matching game with its text rank and distance, when those were searched on'''
+    game: Game
+    rank: Optional[float] = None
+    distance_km: Optional[float] = None
+
+class GameSearchResultsModel(BaseModel):
+    '''Best matches first'''
+    results: List[GameSearchHitModel]
@@ -1,17 +1,120 @@
+import uuid
+from typing import List, Optional
 from datetime import datetime
-from sqlmodel import select, desc
+from sqlalchemy import insert, update, delete, values, column, cast, or_, func, null, literal_column
+from sqlmodel import select, desc, tuple_
 from sqlmodel.ext.asyncio.session import AsyncSession
 
+from src.config import Config
+
 from .models import Game
-from .schemas import GameCreateModel, GameUpdateModel
+from .events import publish_game_event, publish_game_events
+from .schemas import (
+    GameCreateModel, GameUpdateModel, GameFilterModel, GamePageModel, GameSparsePageModel,
+    GameBulkUpdateItem, GameBulkErrorModel, GameBulkResultModel,
+    GameSearchModel, GameSearchHitModel, GameSearchResultsModel
+)
+from .utils import encode_cursor, decode_cursor, parse_game_time
+
+INVALID_GAME_TIME = "Invalid game_time, expected YYYY-MM-DD HH:MM"
+
+# Must match ix_games_search (migration d41b7e8c2f05) token for token, constants inlined
+# rather than bound, or Postgres won't use the index
+SEARCH_CONFIG = literal_column("'english'::regconfig")
+SEARCH_VECTOR = (
+    func.setweight(func.to_tsvector(SEARCH_CONFIG, Game.title), literal_column("'A'"))
+    .op("||")(func.setweight(func.to_tsvector(SEARCH_CONFIG, Game.location), literal_column("'B'")))
+)
+# Must match ix_games_earth
+GAME_POSITION = func.ll_to_earth(Game.latitude, Game.longitude)
 
 class GameService:
-    async def get_all_games(self, session: AsyncSession):
-        statement = select(Game).order_by(desc(Game.created_at))
+    async def get_all_games(self, filters: GameFilterModel, session: AsyncSession, fields: Optional[List[str]] = None):
+        """Return one page of games, newest first, keyed on (created_at, uid), optionally only some fields"""
+        limit = min(filters.limit or Config.GAMES_PAGE_SIZE_DEFAULT, Config.GAMES_PAGE_SIZE_MAX)
+        # The cursor is built from the last row, so its columns are always selected
+        statement = select(Game) if fields is None else select(*self._columns(fields, "created_at", "uid"))
+
+        # Resume right after the last game of the previous page
+        if filters.cursor:
+            created_at, uid = decode_cursor(filters.cursor)
+            statement = statement.where(tuple_(Game.created_at, Game.uid) < (created_at, uid))
+
+        # Filters are pushed down into the WHERE clause
+        if filters.game_time_from is not None:
+            statement = statement.where(Game.game_time >= filters.game_time_from)
+        if filters.game_time_to is not None:
+            statement = statement.where(Game.game_time <= filters.game_time_to)
+        if filters.buy_in_min is not None:
+            statement = statement.where(Game.buy_in >= filters.buy_in_min)
+        if filters.buy_in_max is not None:
+            statement = statement.where(Game.buy_in <= filters.buy_in_max)
+        if filters.location is not None:
+            statement = statement.where(Game.location == filters.location)
+        if filters.host is not None:
+            statement = statement.where(Game.host == filters.host)
+
+        # Fetch one extra row to know whether another page exists
+        statement = statement.order_by(desc(Game.created_at), desc(Game.uid)).limit(limit + 1)
         result = await session.exec(statement)
-        return result.all()
+        games = result.all()
+
+        next_cursor = None
+        if len(games) > limit:
+            games = games[:limit]
+            last_game = games[-1]
+            next_cursor = encode_cursor(last_game.created_at, last_game.uid)
+
+        if fields is not None:
+            games = [{name: getattr(game, name) for name in fields} for game in games]
+            return GameSparsePageModel(games=games, next_cursor=next_cursor)
+
+        return GamePageModel(games=games, next_cursor=next_cursor)
     
-    async def get_game(self, game_uid: str, session: AsyncSession):
+    async def search_games(self, search: GameSearchModel, session: AsyncSession):
+        """Rank games by text match, then distance, then start time, within the time and buy-in bounds"""
+        limit = min(search.limit or Config.GAMES_PAGE_SIZE_DEFAULT, Config.GAMES_PAGE_SIZE_MAX)
+        rank, distance = null(), null()
+        statement = select(Game)
+
+        # Served by the GIN index on the weighted title/location vector
+        if search.q is not None:
+            query = func.websearch_to_tsquery(SEARCH_CONFIG, search.q)
+            statement = statement.where(SEARCH_VECTOR.op("@@")(query))
+            rank = func.ts_rank_cd(SEARCH_VECTOR, query)
+
+        # The bounding cube is served by the partial GiST index, the exact distance trims its corners
+        if search.lat is not None:
+            origin = func.ll_to_earth(search.lat, search.lng)
+            radius = search.radius_km * 1000
+            distance = func.earth_distance(origin, GAME_POSITION)
+            statement = (
+                statement.where(Game.latitude.is_not(None), Game.longitude.is_not(None))
+                .where(func.earth_box(origin, radius).op("@>")(GAME_POSITION))
+                .where(distance <= radius)
+            )
+            distance = distance / 1000.0
+
+        if search.game_time_from is not None:
+            statement = statement.where(Game.game_time >= search.game_time_from)
+        if search.game_time_to is not None:
+            statement = statement.where(Game.game_time <= search.game_time_to)
+        if search.buy_in_max is not None:
+            statement = statement.where(Game.buy_in <= search.buy_in_max)
+
+        rank, distance = rank.label("rank"), distance.label("distance_km")
+        statement = (
+            statement.add_columns(rank, distance)
+            .order_by(rank.desc().nulls_last(), distance.asc().nulls_last(), Game.game_time, Game.uid)
+            .limit(limit)
+        )
+        result = await session.exec(statement)
+
+        return GameSearchResultsModel(results=[
+            GameSearchHitModel(game=game, rank=rank, distance_km=distance) for game, rank, distance in result.all()
+        ])
+
+    async def get_game(self, game_uid: uuid.UUID, session: AsyncSession):
         statement = select(Game).where(Game.uid == game_uid)
         
         result = await session.exec(statement)
@@ -25,37 +128,183 @@ class GameService:
             **game_data_dict
         )
 
-        new_game.game_time = datetime.strptime(game_data_dict["game_time"], "%Y-%m-%d %H:%M")
+        new_game.game_time = parse_game_time(game_data_dict["game_time"])
 
         session.add(new_game)
         await session.commit()
+        await publish_game_event("game.created", new_game)
         return new_game
     
-    async def update_game(self, game_uid: str, game_data: GameUpdateModel, session: AsyncSession):
-        game_to_update = await self.get_game(game_uid, session)
+    async def get_game_fields(self, game_uid: uuid.UUID, fields: List[str], session: AsyncSession):
+        """Select only the requested columns of a game, plus what its ETag and Last-Modified need"""
+        statement = select(*self._columns(fields, "uid", "version", "updated_at")).where(Game.uid == game_uid)
 
-        if game_to_update is not None:
-            update_data_dict = game_data.model_dump()
-            
-            for key, val in update_data_dict.items():
-                value = val
-                if key == "game_time":
-                    value = datetime.strptime(update_data_dict["game_time"], "%Y-%m-%d %H:%M")
+        result = await session.exec(statement)
+        return result.first()
 
-                setattr(game_to_update, key, value)
+    async def game_exists(self, game_uid: uuid.UUID, session: AsyncSession) -> bool:
+        statement = select(Game.uid).where(Game.uid == game_uid)
+        result = await session.exec(statement)
+        return result.first() is not None
+
+    async def update_game(
+        self, game_uid: uuid.UUID, game_data: GameUpdateModel, session: AsyncSession, versions: Optional[List[int]] = None
+    ):
+        """Update a game in one UPDATE ... RETURNING, only if its version is one of versions (when given)"""
+        update_data_dict = game_data.model_dump(exclude_unset=True)
+        update_data_dict["game_time"] = parse_game_time(update_data_dict["game_time"])
+
+        statement = (
+            update(Game)
+            .where(Game.uid == game_uid)
+            .values(**update_data_dict, updated_at=datetime.now(), version=Game.version + 1)
+            .returning(Game)
+        )
+        if versions is not None:
+            statement = statement.where(Game.version.in_(versions))
+
+        result = await session.exec(statement)
+        game_to_update = result.scalars().first()
 
+        if game_to_update is not None:
             await session.commit()
+            await publish_game_event("game.updated", game_to_update)
             return game_to_update
 
         return None
 
-    async def delete_game(self, game_uid: str, session: AsyncSession):
-        game_to_delete = await self.get_game(game_uid, session)
+    async def delete_game(self, game_uid: uuid.UUID, session: AsyncSession, versions: Optional[List[int]] = None):
+        """Delete a game in one DELETE ... RETURNING, only if its version is one of versions (when given)"""
+        statement = delete(Game).where(Game.uid == game_uid).returning(Game)
+        if versions is not None:
+            statement = statement.where(Game.version.in_(versions))
+
+        result = await session.exec(statement)
+        game_to_delete = result.scalars().first()
 
         if game_to_delete is not None:
-            await session.delete(game_to_delete)
             await session.commit()
+            await publish_game_event("game.deleted", game_to_delete)
             return "Game deleted successfully"
 
         return None
-    
\ No newline at end of file
+
+    async def bulk_create_games(self, games_data: List[GameCreateModel], session: AsyncSession):
+        """Host every valid game with one multi-row INSERT ... RETURNING"""
+        rows, errors = [], []
+        for index, game_data in enumerate(games_data):
+            try:
+                game_time = parse_game_time(game_data.game_time)
+            except ValueError:
+                errors.append(GameBulkErrorModel(index=index, detail=INVALID_GAME_TIME))
+                continue
+
+            rows.append({**game_data.model_dump(), "game_time": game_time})
+
+        games = []
+        if rows:
+            statement = insert(Game).returning(Game, sort_by_parameter_order=True)
+            result = await session.exec(statement, params=rows)
+            games = result.scalars().all()
+            await session.commit()
+            await publish_game_events("game.created", games)
+
+        return GameBulkResultModel(games=games, errors=errors)
+
+    async def bulk_update_games(self, games_data: List[GameBulkUpdateItem], session: AsyncSession):
+        """Apply every valid update with one UPDATE ... FROM (VALUES ...) RETURNING"""
+        rows, errors, indexes = [], [], {}
+        for index, game_data in enumerate(games_data):
+            if game_data.uid in indexes:
+                errors.append(GameBulkErrorModel(index=index, uid=game_data.uid, detail="Duplicate uid"))
+                continue
+
+            try:
+                game_time = parse_game_time(game_data.game_time)
+            except ValueError:
+                errors.append(GameBulkErrorModel(index=index, uid=game_data.uid, detail=INVALID_GAME_TIME))
+                continue
+
+            indexes[game_data.uid] = index
+            rows.append((
+                game_data.uid, game_data.title, game_time, game_data.location, game_data.buy_in,
+                game_data.latitude, game_data.longitude, game_data.version
+            ))
+
+        games = []
+        if rows:
+            # Typed after the table's own columns so the driver binds them the same way
+            fields = ("uid", "title", "game_time", "location", "buy_in", "latitude", "longitude", "version")
+            changes = values(
+                *(column(name, Game.__table__.c[name].type) for name in fields),
+                name="changes"
+            ).data(rows)
+            # A None cell is rendered as a bare NULL, so a batch without versions or coordinates gives Postgres a text column
+            version = cast(changes.c.version, Game.__table__.c.version.type)
+
+            statement = (
+                update(Game)
+                .where(Game.uid == changes.c.uid)
+                .where(or_(version.is_(None), Game.version == version))
+                .values(
+                    title=changes.c.title,
+                    game_time=changes.c.game_time,
+                    location=changes.c.location,
+                    buy_in=changes.c.buy_in,
+                    # Unlike a single PATCH, a bulk item can't clear coordinates, only replace them
+                    latitude=func.coalesce(cast(changes.c.latitude, Game.__table__.c.latitude.type), Game.latitude),
+                    longitude=func.coalesce(cast(changes.c.longitude, Game.__table__.c.longitude.type), Game.longitude),
+                    updated_at=datetime.now(),
+                    version=Game.version + 1,
+                )
+                .returning(Game)
+            )
+            result = await session.exec(statement)
+            games = result.scalars().all()
+            await session.commit()
+            await publish_game_events("game.updated", games)
+
+        # Only a miss needs a second look: the game is either gone or at another version
+        missing = self._missing_games(indexes, games)
+        if missing:
+            result = await session.exec(select(Game.uid).where(Game.uid.in_([error.uid for error in missing])))
+            conflicts = set(result.all())
+            for error in missing:
+                if error.uid in conflicts:
+                    error.detail = "Version mismatch"
+
+        errors += missing
+        return GameBulkResultModel(games=games, errors=sorted(errors, key=lambda e: e.index))
+
+    async def bulk_delete_games(self, game_uids: List[uuid.UUID], session: AsyncSession):
+        """Delete every listed game with one DELETE ... RETURNING"""
+        errors, indexes = [], {}
+        for index, game_uid in enumerate(game_uids):
+            if game_uid in indexes:
+                errors.append(GameBulkErrorModel(index=index, uid=game_uid, detail="Duplicate uid"))
+                continue
+
+            indexes[game_uid] = index
+
+        statement = delete(Game).where(Game.uid.in_(list(indexes))).returning(Game)
+        result = await session.exec(statement)
+        games = result.scalars().all()
+        await session.commit()
+        if games:
+            await publish_game_events("game.deleted", games)
+
+        errors += self._missing_games(indexes, games)
+        return GameBulkResultModel(games=games, errors=sorted(errors, key=lambda e: e.index))
+
+    @staticmethod
+    def _columns(fields: List[str], *required: str) -> list:
+        return [getattr(Game, name) for name in dict.fromkeys([*fields, *required])]
+
+    @staticmethod
+    def _missing_games(indexes: dict[uuid.UUID, int], games: List[Game]) -> List[GameBulkErrorModel]:
+        """Report the requested uids the statement didn't match"""
+        found = {game.uid for game in games}
+        return [
+            GameBulkErrorModel(index=index, uid=game_uid, detail="Game not found")
+            for game_uid, index in indexes.items() if game_uid not in found
+        ]
@@ -0,0 +1,89 @@
+import json
+import uuid
+import base64
+import hashlib
+import binascii
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from fastapi import Request
+
+from src.responses import base_etag
+
+from .models import Game
+
+def parse_game_time(game_time: str) -> datetime:
+    '''Parse the "YYYY-MM-DD HH:MM" game time clients send'''
+    return datetime.strptime(game_time, "%Y-%m-%d %H:%M")
+
+def encode_cursor(created_at: datetime, uid: uuid.UUID) -> str:
+    '''Pack the keyset position of the last game on a page into an opaque cursor'''
+    raw = json.dumps([created_at.isoformat(), str(uid)])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple[datetime, uuid.UUID]:
+    '''Unpack a cursor back into its (created_at, uid) keyset position'''
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, uid = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created_at), uuid.UUID(uid)
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError) as e:
+        raise ValueError("Invalid cursor") from e
+
+def game_etag(game: Game) -> str:
+    '''Strong ETag of a single game, derived from its uid and row version'''
+    return f'"{game.uid.hex}-{game.version}"'
+
+def if_match_versions(request: Request, game_uid: uuid.UUID) -> list[int] | None:
+    '''Game versions allowed by If-Match, or None when the write is unconditional'''
+    if_match = request.headers.get("if-match")
+    if if_match is None or if_match.strip() == "*":
+        return None
+
+    # Strong comparison: weak tags and other games' tags never match
+    versions = []
+    for tag in if_match.split(","):
+        tag = base_etag(tag.strip())
+        if not (tag.startswith('"') and tag.endswith('"')):
+            continue
+
+        tag_uid, _, tag_version = tag[1:-1].partition("-")
+        if tag_uid == game_uid.hex and tag_version.isdigit():
+            versions.append(int(tag_version))
+
+    return versions
+
+def query_digest(request: Request) -> str:
+    '''Order-independent digest of the query string, so ?a=1&b=2 and ?b=2&a=1 share cache entries'''
+    query = "&".join(sorted(f"{key}={value}" for key, value in request.query_params.multi_items()))
+    return hashlib.sha1(query.encode('utf-8')).hexdigest()
+
+def game_list_etag(body: bytes) -> str:
+    '''Strong ETag of a game listing, hashed from the served page so it can't describe other rows'''
+    return f'"{hashlib.sha1(body).hexdigest()}"'
+
+def http_date(moment: datetime) -> str:
+    '''Format a timestamp for Last-Modified (naive values are the server's local time)'''
+    return format_datetime(moment.astimezone(timezone.utc), usegmt=True)
+
+def is_not_modified(request: Request, etag: str, last_modified: datetime | None) -> bool:
+    '''Evaluate If-None-Match, or If-Modified-Since when no ETag was sent (RFC 9110)'''
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+
+        # Weak comparison: W/"x" matches "x", and so do the msgpack and compressed tags of "x"
+        candidates = [base_etag(tag.strip().removeprefix("W/")) for tag in if_none_match.split(",")]
+        return etag in candidates
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+
+        # HTTP dates have one-second resolution
+        return int(last_modified.astimezone(timezone.utc).timestamp()) <= int(since.timestamp())
+
+    return False
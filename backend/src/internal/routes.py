@@ -0,0 +1,34 @@
+from fastapi import APIRouter, Depends
+
+from src.db.main import get_pool_stats
+from src.db.slow_query import slow_query_log
+from src.auth.utils import hash_pool
+from src.auth.dependencies import RoleChecker, AccessTokenBearer
+
+internal_router = APIRouter()
+access_token_bearer = Depends(AccessTokenBearer())
+role_checker = Depends(RoleChecker(["admin"]))
+
+@internal_router.get(
+    "/pool",
+    dependencies=[access_token_bearer, role_checker]
+)
+async def get_pool_status():
+    """Return DB connection pool usage for this worker"""
+    return get_pool_stats()
+
+@internal_router.get(
+    "/slow-queries",
+    dependencies=[access_token_bearer, role_checker]
+)
+async def get_slow_queries():
+    """Return this worker's most recent slow statements, newest first"""
+    return slow_query_log.recent()
+
+@internal_router.get(
+    "/hash-pool",
+    dependencies=[access_token_bearer, role_checker]
+)
+async def get_hash_pool_status():
+    """Return this worker's bcrypt queue depth and in-flight jobs"""
+    return hash_pool.stats()
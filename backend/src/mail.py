@@ -1,25 +1,264 @@
-import resend
+import sys
+import json
+import time
+import uuid
+import asyncio
+import logging
+from functools import cache
 from pydantic import BaseModel
 
 from .config import Config
-resend.api_key = Config.RESEND_API_KEY
+from .db.redis import redis_client
+from .metrics import MAIL_SEND_SECONDS
+
+OUTBOX_KEY = "mail:outbox"
+# Claimed messages, one list per worker: "mail:processing:<worker id>"
+PROCESSING_KEY = "mail:processing"
+WORKERS_KEY = "mail:workers"
+RETRY_KEY = "mail:retry"
+DEAD_LETTER_KEY = "mail:dead"
+
+# Requeue a claim only if it is still there, a delivery may have dropped it since it was read
+REQUEUE_SCRIPT = redis_client.register_script("""
+if redis.call('LREM', KEYS[1], 1, ARGV[1]) > 0 then
+    redis.call('LPUSH', KEYS[2], ARGV[1])
+    return 1
+end
+return 0
+""")
 
 class EmailModel(BaseModel):
     '''Email list schema'''
     addresses: list[str]
-    
+
+@cache
+def load_resend():
+    '''Import the Resend SDK on first send, it is slow to import and most workers rarely mail'''
+    import resend
+    resend.api_key = Config.RESEND_API_KEY
+    return resend
+
+class ResendProvider:
+    '''Deliver through the Resend API (its SDK is blocking, so it runs in a thread)'''
+    async def send(self, message: dict) -> None:
+        resend = load_resend()
+        params: resend.Emails.SendParams = {
+            "from": "PokerU <onboarding@resend.dev>",
+            "to": message["to"],
+            "subject": message["subject"],
+            "html": message["html"],
+            "reply_to": "pokerufromtulane@gmail.com",
+        }
+        await asyncio.to_thread(resend.Emails.send, params)
+
+class StdoutProvider:
+    '''Print messages instead of sending them, for local runs'''
+    async def send(self, message: dict) -> None:
+        print(json.dumps(message), file=sys.stdout, flush=True)
+
+class FileProvider:
+    '''Append messages to a JSON-lines file, for offline load tests'''
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def write(self, line: str) -> None:
+        with open(self.path, "a") as f:
+            f.write(line + "\n")
+
+    async def send(self, message: dict) -> None:
+        await asyncio.to_thread(self.write, json.dumps(message))
+
+def get_provider():
+    '''Pick the delivery backend configured by MAIL_PROVIDER'''
+    if Config.MAIL_PROVIDER == "stdout":
+        return StdoutProvider()
+    if Config.MAIL_PROVIDER == "file":
+        return FileProvider(Config.MAIL_FILE_PATH)
+
+    return ResendProvider()
+
+class MailOutbox:
+    '''Redis-backed outbox: routes enqueue, a background worker delivers with retries'''
+    def __init__(self, provider) -> None:
+        self.provider = provider
+        self.semaphore = asyncio.Semaphore(Config.MAIL_WORKER_CONCURRENCY)
+        self.worker_task: asyncio.Task | None = None
+        self.deliveries: set[asyncio.Task] = set()
+        self.worker_id = uuid.uuid4().hex
+        self.processing_key = self.processing_key_of(self.worker_id)
+        # Claimed messages this worker is delivering right now
+        self.in_flight: set[bytes] = set()
+        # True while a BLMOVE may have claimed a message that isn't in in_flight yet
+        self.claiming = False
+
+    @staticmethod
+    def processing_key_of(worker_id: str) -> str:
+        return f"{PROCESSING_KEY}:{worker_id}"
+
+    @staticmethod
+    def heartbeat_key_of(worker_id: str) -> str:
+        return f"mail:worker:{worker_id}"
+
+    async def enqueue(self, recipients: list[str], mail_subject: str, mail_body: str) -> str:
+        '''Queue a message for delivery and return its id without waiting for the provider'''
+        message = {
+            "id": str(uuid.uuid4()),
+            "to": recipients,
+            "subject": mail_subject,
+            "html": mail_body,
+            "attempts": 0,
+        }
+        await redis_client.lpush(OUTBOX_KEY, json.dumps(message))
+
+        if Config.MAIL_WORKER_IN_PROCESS:
+            self.start_worker()
+
+        return message["id"]
+
+    def start_worker(self) -> None:
+        '''Run the delivery loop in this process unless it is already running'''
+        if self.worker_task is None or self.worker_task.done():
+            self.worker_task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop_worker(self) -> None:
+        '''Stop the delivery loop and hand this worker's claimed messages back to the outbox'''
+        if self.worker_task is None:
+            return
+
+        self.worker_task.cancel()
+        for task in self.deliveries:
+            task.cancel()
+        await asyncio.gather(self.worker_task, *self.deliveries, return_exceptions=True)
+        self.worker_task = None
+
+        await self.requeue_all(self.processing_key)
+        await redis_client.delete(self.heartbeat_key_of(self.worker_id))
+        await redis_client.srem(WORKERS_KEY, self.worker_id)
+
+    async def requeue_all(self, processing_key: str) -> None:
+        while await redis_client.lmove(processing_key, OUTBOX_KEY, "RIGHT", "RIGHT"):
+            pass
+
+    async def recover(self) -> None:
+        '''Requeue messages claimed by workers that stopped heartbeating, and this worker's stranded ones'''
+        # Claims left by workers from before per-worker processing lists
+        await self.requeue_all(PROCESSING_KEY)
+
+        for worker_id in await redis_client.smembers(WORKERS_KEY):
+            worker_id = worker_id.decode()
+            if worker_id == self.worker_id or await redis_client.exists(self.heartbeat_key_of(worker_id)):
+                continue
+
+            # LMOVE is atomic, so workers recovering the same list at once just split it
+            await self.requeue_all(self.processing_key_of(worker_id))
+            await redis_client.srem(WORKERS_KEY, worker_id)
+
+        # Ours that no delivery holds any more, e.g. its retry write failed
+        for raw in await redis_client.lrange(self.processing_key, 0, -1):
+            if self.claiming:
+                # The list may hold a claim whose BLMOVE reply hasn't reached run() yet
+                break
+            if raw not in self.in_flight:
+                await REQUEUE_SCRIPT(keys=[self.processing_key, OUTBOX_KEY], args=[raw])
+
+    async def maintain(self) -> None:
+        '''Keep this worker's heartbeat alive and periodically recover stranded messages'''
+        while True:
+            try:
+                await redis_client.set(self.heartbeat_key_of(self.worker_id), 1, ex=Config.MAIL_WORKER_HEARTBEAT_TTL)
+                await redis_client.sadd(WORKERS_KEY, self.worker_id)
+                await self.recover()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.exception(e)
+
+            await asyncio.sleep(Config.MAIL_WORKER_HEARTBEAT_TTL / 3)
+
+    async def run(self) -> None:
+        '''Drain the outbox forever, delivering at most MAIL_WORKER_CONCURRENCY at a time'''
+        maintenance = asyncio.create_task(self.maintain())
+        try:
+            while True:
+                try:
+                    await self.promote_due_retries()
+
+                    await self.semaphore.acquire()
+                    self.claiming = True
+                    try:
+                        raw = await redis_client.blmove(OUTBOX_KEY, self.processing_key, 1, "RIGHT", "LEFT")
+                    except BaseException:
+                        self.semaphore.release()
+                        raise
+                    finally:
+                        self.claiming = False
+
+                    if raw is None:
+                        self.semaphore.release()
+                        continue
+
+                    # Marked with no await since claiming was cleared, so recover() never takes it for stranded
+                    self.in_flight.add(raw)
+                    task = asyncio.create_task(self.deliver(raw))
+                    self.deliveries.add(task)
+                    task.add_done_callback(self.deliveries.discard)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logging.exception(e)
+                    await asyncio.sleep(1)
+        finally:
+            maintenance.cancel()
+
+    async def deliver(self, raw: bytes) -> None:
+        '''Send one claimed message, then retry it later or dead-letter it on failure'''
+        message = json.loads(raw)
+        provider = type(self.provider).__name__
+        start = time.perf_counter()
+        try:
+            try:
+                await self.provider.send(message)
+                MAIL_SEND_SECONDS.labels(provider, "sent").observe(time.perf_counter() - start)
+            except Exception as e:
+                MAIL_SEND_SECONDS.labels(provider, "failed").observe(time.perf_counter() - start)
+                logging.warning("Email %s failed on attempt %s: %s", message["id"], message["attempts"] + 1, e)
+                await self.schedule_retry(message)
+
+            # Only drop the claim once the message was sent or its retry is stored
+            await redis_client.lrem(self.processing_key, 1, raw)
+        except Exception as e:
+            # Still claimed, recover() requeues it
+            logging.exception(e)
+        finally:
+            self.in_flight.discard(raw)
+            self.semaphore.release()
+
+    async def schedule_retry(self, message: dict) -> None:
+        message["attempts"] += 1
+        if message["attempts"] >= Config.MAIL_MAX_ATTEMPTS:
+            await redis_client.lpush(DEAD_LETTER_KEY, json.dumps(message))
+            return
+
+        # Exponential backoff: base, 2 * base, 4 * base, ... capped
+        delay = min(Config.MAIL_RETRY_BASE_DELAY * 2 ** (message["attempts"] - 1), Config.MAIL_RETRY_MAX_DELAY)
+        await redis_client.zadd(RETRY_KEY, {json.dumps(message): time.time() + delay})
+
+    async def promote_due_retries(self) -> None:
+        '''Move retries whose backoff has elapsed back onto the outbox'''
+        due = await redis_client.zrangebyscore(RETRY_KEY, "-inf", time.time())
+        for raw in due:
+            # Only the worker that wins the ZREM requeues the message
+            if await redis_client.zrem(RETRY_KEY, raw):
+                await redis_client.lpush(OUTBOX_KEY, raw)
+
+mail_outbox = MailOutbox(get_provider())
+
 async def send_message(
     recipients: list[str], mail_subject: str, mail_body: str
 ):
-    '''Initalize all necessary params to be sent in Resend email API'''
-
-    params: resend.Emails.SendParams = {
-        "from": "PokerU <onboarding@resend.dev>",
-        "to": recipients,
-        "subject": mail_subject,
-        "html": mail_body,
-        "reply_to": "pokerufromtulane@gmail.com",
-    }
-
-    email = resend.Emails.send(params)
-    return email
+    '''Queue an email in the outbox; the worker delivers it in the background'''
+    return await mail_outbox.enqueue(recipients, mail_subject, mail_body)
+
+if __name__ == "__main__":
+    # Dedicated worker: python -m src.mail (set MAIL_WORKER_IN_PROCESS=false on the API)
+    asyncio.run(mail_outbox.run())
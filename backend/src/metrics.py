@@ -0,0 +1,126 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from prometheus_client import Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Kinds of work timed inside a request, also the Server-Timing metric names
+KINDS = ("sql", "redis", "bcrypt")
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Request latency", ["method", "route", "status"]
+)
+REQUEST_CALLS = {
+    "sql": Histogram(
+        "http_request_sql_statements", "SQL statements per request", ["route"],
+        buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50)
+    ),
+    "redis": Histogram(
+        "http_request_redis_round_trips", "Redis round trips per request", ["route"],
+        buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50)
+    ),
+}
+REQUEST_SECONDS = {
+    kind: Histogram(f"http_request_{kind}_seconds", f"Time per request spent in {kind}", ["route"])
+    for kind in KINDS
+}
+HASH_QUEUE_DEPTH = Gauge("bcrypt_queue_depth", "bcrypt jobs waiting for a free pool slot")
+HASH_IN_FLIGHT = Gauge("bcrypt_in_flight", "bcrypt jobs running on the pool")
+MAIL_SEND_SECONDS = Histogram(
+    "mail_send_seconds", "Time to hand one email to the provider", ["provider", "outcome"]
+)
+
+class RequestTimings:
+    '''Calls and seconds per kind of work, accumulated over one request'''
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.calls = dict.fromkeys(KINDS, 0)
+        self.seconds = dict.fromkeys(KINDS, 0.0)
+
+    def add(self, kind: str, seconds: float) -> None:
+        self.calls[kind] += 1
+        self.seconds[kind] += seconds
+
+    def server_timing(self) -> str:
+        '''Server-Timing header value, durations in ms'''
+        metrics = [
+            f'{kind};dur={self.seconds[kind] * 1000:.1f};desc="{self.calls[kind]} calls"'
+            for kind in KINDS if self.calls[kind]
+        ]
+        metrics.append(f"app;dur={(time.perf_counter() - self.start) * 1000:.1f}")
+        return ", ".join(metrics)
+
+# Set by MetricsMiddleware for the request being handled
+current_timings: ContextVar[RequestTimings | None] = ContextVar("current_timings", default=None)
+
+@contextmanager
+def timed(kind: str):
+    '''Charge the wrapped call to the current request's timings, if there is one'''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = current_timings.get()
+        if timings is not None:
+            timings.add(kind, time.perf_counter() - start)
+
+# Registered on the Engine class, so the primary and every replica are covered
+@event.listens_for(Engine, "before_cursor_execute")
+def start_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    context.statement_start = time.perf_counter()
+
+@event.listens_for(Engine, "after_cursor_execute")
+def stop_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    timings = current_timings.get()
+    if timings is not None:
+        timings.add("sql", time.perf_counter() - context.statement_start)
+
+def route_template(scope: Scope) -> str:
+    '''Matched route template, e.g. /api/v1/games/{game_uid}, so every uid is one series'''
+    if scope.get("route") is None:
+        return "unmatched"
+
+    # Routes of included routers only know their own path, FastAPI keeps the prefixed one here
+    context = scope.get("fastapi", {}).get("effective_route_context")
+    return getattr(context, "path_format", None) or scope["route"].path_format
+
+class MetricsMiddleware:
+    '''Record latency and SQL/Redis/bcrypt work per route template, optionally as Server-Timing'''
+    def __init__(self, app: ASGIApp, server_timing: bool = False) -> None:
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        status_code = 500
+
+        async def send_with_timings(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if self.server_timing:
+                    MutableHeaders(scope=message).append("Server-Timing", timings.server_timing())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timings)
+        finally:
+            current_timings.reset(token)
+            route = route_template(scope)
+            REQUEST_LATENCY.labels(scope["method"], route, str(status_code)).observe(time.perf_counter() - timings.start)
+            for kind, histogram in REQUEST_CALLS.items():
+                histogram.labels(route).observe(timings.calls[kind])
+            for kind, histogram in REQUEST_SECONDS.items():
+                histogram.labels(route).observe(timings.seconds[kind])
+
+def metrics_response() -> tuple[bytes, str]:
+    '''Every metric in the Prometheus text exposition format'''
+    return generate_latest(), CONTENT_TYPE_LATEST
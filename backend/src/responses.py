@@ -0,0 +1,151 @@
+import json
+from typing import Any, Callable
+from contextvars import ContextVar
+import msgpack
+from pydantic import BaseModel, TypeAdapter
+from fastapi import Request, Response, status
+from fastapi.exceptions import HTTPException
+from fastapi.routing import APIRoute
+
+from .config import Config
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack")
+# Added to an ETag per representation, so a cache never takes msgpack or brotli bytes for the JSON body
+ETAG_SUFFIXES = ("msgpack", "br", "gzip")
+
+# Whether the request being handled asked for MessagePack, set by NegotiatedRoute
+wants_msgpack: ContextVar[bool] = ContextVar("wants_msgpack", default=False)
+
+def parse_qvalues(header: str) -> dict[str, float]:
+    '''Map each token of an Accept-style header to its q-value, e.g. "br;q=0.5" -> {"br": 0.5}'''
+    qvalues = {}
+    for item in header.split(","):
+        token, *params = [part.strip() for part in item.split(";")]
+        if not token:
+            continue
+
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+
+        qvalues[token.lower()] = max(q, qvalues.get(token.lower(), 0.0))
+
+    return qvalues
+
+def accepts_msgpack(accept: str) -> bool:
+    '''True when the client ranks MessagePack at least as high as JSON'''
+    qvalues = parse_qvalues(accept)
+    msgpack_q = max(qvalues.get(media_type, 0.0) for media_type in MSGPACK_MEDIA_TYPES)
+    json_q = max(qvalues.get("application/json", 0.0), qvalues.get("*/*", 0.0))
+    return msgpack_q > 0 and msgpack_q >= json_q
+
+def representation_etag(etag: str, suffix: str) -> str:
+    '''Tag one representation of a resource state, e.g. "abc" -> "abc-msgpack"'''
+    if not etag.endswith('"'):
+        return etag
+    return f'{etag[:-1]}-{suffix}"'
+
+def base_etag(etag: str) -> str:
+    '''The resource-state tag a representation's tag was made from, e.g. "abc-msgpack-br" -> "abc"'''
+    while True:
+        for suffix in ETAG_SUFFIXES:
+            if etag.endswith(f'-{suffix}"'):
+                etag = f'{etag[:-len(suffix) - 2]}"'
+                break
+        else:
+            return etag
+
+class ModelJSON:
+    '''Writes already-validated models of one type straight to JSON (or MessagePack) bytes'''
+    def __init__(self, annotation: Any, matches_response_model: bool = True) -> None:
+        self.adapter = TypeAdapter(annotation)
+        # False for shapes the route's response_model can't validate, e.g. sparse fieldsets
+        self.matches_response_model = matches_response_model
+
+    def dumps(self, content: Any) -> bytes:
+        '''Serialize without re-validating: pydantic-core alone, or its Python output through orjson'''
+        if Config.JSON_RESPONSE_MODE == "orjson" and orjson is not None:
+            return orjson.dumps(self.adapter.dump_python(content))
+
+        return self.adapter.dump_json(content)
+
+    def packb(self, content: Any) -> bytes:
+        '''Same document as dumps (datetimes and uids as strings), encoded as MessagePack'''
+        return msgpack.packb(self.adapter.dump_python(content, mode="json"))
+
+    def render(self, content: Any, response: Response | None = None, status_code: int = 200) -> Any:
+        '''Pre-encoded response in a fast mode; in "standard" mode the content goes through response_model'''
+        headers = dict(response.headers) if response is not None else None
+        if wants_msgpack.get():
+            return Response(content=self.packb(content), status_code=status_code, headers=headers, media_type="application/msgpack")
+
+        if Config.JSON_RESPONSE_MODE == "standard" and self.matches_response_model:
+            return content
+
+        # A returned Response replaces the injected one, so carry its headers over
+        return Response(
+            content=self.dumps(content),
+            status_code=status_code,
+            headers=headers,
+            media_type="application/json"
+        )
+
+class SparseFields:
+    '''Parses ?fields=a,b into field names of a model, rejecting names it doesn't expose'''
+    def __init__(self, model: type[BaseModel]) -> None:
+        self.allowed = [name for name, field in model.model_fields.items() if not field.exclude]
+
+    def __call__(self, fields: str | None = None) -> list[str] | None:
+        if fields is None:
+            return None
+
+        requested = list(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+        unknown = [name for name in requested if name not in self.allowed]
+        if unknown or not requested:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Invalid fields {', '.join(unknown) or repr(fields)}, choose from {', '.join(self.allowed)}"
+            )
+
+        return requested
+
+class NegotiatedRoute(APIRoute):
+    '''Route that answers in MessagePack when the client's Accept header prefers it'''
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def negotiated_handler(request: Request) -> Response:
+            msgpack_requested = accepts_msgpack(request.headers.get("accept", ""))
+            token = wants_msgpack.set(msgpack_requested)
+            try:
+                response = await handler(request)
+            finally:
+                wants_msgpack.reset(token)
+
+            response.headers.append("Vary", "Accept")
+            # Also on a 304, which must carry the tag of the body the client holds
+            if msgpack_requested and "etag" in response.headers:
+                response.headers["ETag"] = representation_etag(response.headers["etag"], "msgpack")
+
+            # Routes without a ModelJSON fast path answered in JSON, transcode those
+            body = getattr(response, "body", b"")
+            if msgpack_requested and body and response.media_type == "application/json":
+                body = msgpack.packb(json.loads(body))
+                response.body = body
+                response.headers["Content-Length"] = str(len(body))
+                response.headers["Content-Type"] = "application/msgpack"
+                response.media_type = "application/msgpack"
+
+            return response
+
+        return negotiated_handler